@@ -0,0 +1,45 @@
+# Shared helpers of the benchmark scripts. Run the scripts from the repository root, like the
+# app: python benchmarks/<script>.py
+import os
+import sys
+import time
+
+# The app's modules are imported as utils.*, like in the pages
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webapp"))
+
+
+def memory_mb(field, pid="self"):
+    """
+    A memory field of a process, by default this one, in MB: "VmRSS" for the resident memory
+    or "VmHWM" for its peak (Linux).
+    """
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def rss_mb():
+    return memory_mb("VmRSS")
+
+
+def reset_peak_memory():
+    """
+    Restart the peak resident memory of this process from its current resident memory (Linux).
+    """
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def best_of(func, repeat=5):
+    """
+    The fastest of repeat runs of func in ms, and its result.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
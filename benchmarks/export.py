@@ -0,0 +1,58 @@
+# The time, size and peak memory of every download format, for one kommune and the whole
+# country, with the pandas Excel export it replaced for comparison. Every export runs in a new
+# process, so memory freed by an earlier export cannot hide the peak of the next one.
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import pandas as pd
+import polars as pl
+from common import memory_mb, reset_peak_memory, rss_mb
+from utils.data_processing import export_frame
+from utils.dataset import get_dataset
+from utils.export import write_csv, write_excel, write_parquet
+
+
+def write_excel_pandas(df):
+    # The export before the streaming one: a pandas copy written into an in-memory workbook
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_pandas().to_excel(writer, index=False)
+    return output.getvalue()
+
+
+FORMATS = {
+    "Excel": write_excel,
+    "Excel (pandas)": write_excel_pandas,
+    "CSV": write_csv,
+    "Parquet": write_parquet,
+}
+
+# The rows exported, by the area selected (None is the whole country)
+AREAS = ["Aarhus", None]
+
+
+def measure(kind, area):
+    df = export_frame(get_dataset().df)
+    if area is not None:
+        df = df.filter(pl.col("Område") == area)
+    rss = rss_mb()
+    reset_peak_memory()
+    started = time.perf_counter()
+    data = FORMATS[kind](df)
+    elapsed = time.perf_counter() - started
+    peak = memory_mb("VmHWM") - rss
+    print(
+        f"{kind:15} {area or 'Hele landet':12} {df.height:>7} rows {len(data) / 1e6:6.1f} MB "
+        f"{elapsed:6.2f}s  peak memory +{peak:.0f} MB (from {rss:.0f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        measure(sys.argv[1], sys.argv[2] or None)
+    else:
+        for area in AREAS:
+            for kind in FORMATS:
+                subprocess.run([sys.executable, __file__, kind, area or ""], check=True)
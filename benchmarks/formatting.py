@@ -0,0 +1,81 @@
+# The vectorized Danish number formatting against babel: every value must format the same, and
+# the throughput of both on the market values of the national table. Exits with an error if any
+# value differs, so it can guard changes to utils/formatting.py.
+import sys
+
+import numpy as np
+import polars as pl
+from common import best_of
+from utils.data_processing import format_number_european, round_to_million_or_billion
+from utils.dataset import get_dataset
+from utils.formatting import MAX_DIGITS, format_number_expr, million_or_billion_expr
+
+# The random values compared per number of digits
+VALUES_PER_DIGITS = 50_000
+
+# How many differing values are shown
+REPORTED_VALUES = 5
+
+
+def test_values(digits, rng):
+    """
+    Values of every magnitude up to the exact range of the formatter (see format_number_expr),
+    with ties at the digits, exact binary ties and the special values.
+    """
+    limit = 2**52 / 10**digits
+    n = VALUES_PER_DIGITS // 4
+    sign = rng.choice([-1.0, 1.0], n)
+    magnitudes = sign * 10 ** rng.uniform(-4, np.log10(limit), n)
+    ties = (rng.integers(-(10**9), 10**9, n) + 0.5) / 10**digits
+    binary_ties = rng.integers(-(10**6), 10**6, n) / 2 ** (digits + 1)
+    integers = rng.integers(-(2**52), 2**52, n) // 10**digits * 1.0
+    special = [0.0, -0.0, -0.3, 0.5, -0.5, 1.5, 2.5, np.nan, np.inf, -np.inf, limit - 1]
+    # As Python floats, like the values of a frame; numpy's round is not correctly rounded
+    return np.concatenate([magnitudes, ties, binary_ties, integers, special]).tolist()
+
+
+def formatted(expr, values):
+    return pl.DataFrame({"Value": values}).select(expr).to_series().to_list()
+
+
+def compare(name, expected, actual, values):
+    differing = [i for i, (a, b) in enumerate(zip(expected, actual)) if a != b]
+    for i in differing[:REPORTED_VALUES]:
+        print(f"  {name}({values[i]!r}): babel {expected[i]!r}, vectorized {actual[i]!r}")
+    print(f"{name}: {len(values) - len(differing)} of {len(values)} values identical")
+    return not differing
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    identical = True
+    for digits in range(MAX_DIGITS + 1):
+        values = test_values(digits, rng)
+        actual = formatted(format_number_expr(pl.col("Value"), digits), values)
+        expected = [format_number_european(value, digits) for value in values]
+        identical &= compare(f"format_number_expr(digits={digits})", expected, actual, values)
+
+    values = test_values(0, rng)
+    values = [value for value in values if np.isfinite(value)]
+    # Millions and billions that are ties at the digits of the suffix
+    ties = rng.integers(-(10**9), 10**9, VALUES_PER_DIGITS // 4) * 10**4 + 5 * 10**3
+    values += ties.tolist() + (ties * 1000).tolist()
+    actual = formatted(million_or_billion_expr(pl.col("Value")), values)
+    expected = [round_to_million_or_billion(value) for value in values]
+    identical &= compare("million_or_billion_expr", expected, actual, values)
+
+    # The market values of the national table, as the results table formatted them
+    market_values = get_dataset().df["Markedsværdi (DKK)"]
+    babel_ms, _ = best_of(
+        lambda: market_values.map_elements(format_number_european, return_dtype=pl.Utf8), repeat=3
+    )
+    vectorized_ms, _ = best_of(
+        lambda: market_values.to_frame().select(format_number_expr(pl.all()))
+    )
+    print()
+    print(
+        f"{market_values.len()} market values: babel {babel_ms:.0f} ms, "
+        f"vectorized {vectorized_ms:.0f} ms"
+    )
+
+    sys.exit(0 if identical else 1)
@@ -0,0 +1,122 @@
+# The single lazy InvestmentQuery plan against the eager chain of filters the pages ran before
+# it, which materialized a frame after every step.
+import re
+
+import polars as pl
+from common import best_of
+from utils.areas import get_area_index
+from utils.database import read_investments
+from utils.dataset import get_dataset
+from utils.isin import get_isin_index
+from utils.query import InvestmentQuery, QueryIndexes
+from utils.search import get_search_index
+
+# The selections of the benchmark, as (name, query). The search terms have no synonyms, so all
+# three ways find the same rows.
+QUERIES = [
+    ("Hele landet", InvestmentQuery()),
+    ("Aarhus", InvestmentQuery(choice="Aarhus")),
+    ("Alle kommuner + kategori", InvestmentQuery(choice="Alle kommuner", categories=("Klima",))),
+    ("Hele landet + søgning", InvestmentQuery(search_query="bank")),
+    (
+        "Flere områder + søgning + kategori",
+        InvestmentQuery(
+            areas=("Aarhus", "Odense", "Region Sjælland"),
+            search_query="tobak",
+            categories=("Klima",),
+        ),
+    ),
+]
+
+
+# The eager chain, as the pages ran it on the frame read from SQLite
+def eager_choice(df, choice):
+    if choice == "Hele landet":
+        return df
+    elif choice == "Alle kommuner":
+        return df.filter(~df["Område"].str.starts_with("Region"))
+    elif choice == "Alle regioner":
+        return df.filter(df["Område"].str.starts_with("Region"))
+    return df.filter(df["Område"] == choice)
+
+
+def eager_areas(df, areas):
+    specific = [
+        area for area in areas if area not in ["Hele landet", "Alle kommuner", "Alle regioner"]
+    ]
+    return df.filter(pl.col("Område").is_in(specific)) if specific else df
+
+
+def eager_search(df, search_query):
+    if not search_query:
+        return df
+    query = re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", search_query).lower()).strip()
+    df = df.with_columns([pl.col(col).fill_null("").cast(str) for col in df.columns])
+    condition = None
+    for col in df.columns:
+        normalized = (
+            pl.col(col)
+            .str.replace_all(r"[^\w\s]", " ")
+            .str.to_lowercase()
+            .str.replace_all(r"\s+", " ")
+            .str.strip_chars()
+            .str.contains(query)
+        )
+        condition = normalized if condition is None else condition | normalized
+    return df.filter(condition)
+
+
+def eager_categories(df, categories):
+    if not categories:
+        return df
+    return df.filter(
+        pl.col("Problemkategori").map_elements(
+            lambda x: any(cat in x for cat in categories), return_dtype=pl.Boolean
+        )
+    )
+
+
+def eager_sort(df):
+    df = df.with_columns(
+        pl.col("Markedsværdi (DKK)").cast(pl.Float64),
+        pl.col("Sortlistet").cast(pl.Int32),
+        pl.col("Priority").cast(pl.Float64, strict=False),
+    )
+    df = df.sort(
+        ["Sortlistet", "Priority", "Område", "ISIN kode"],
+        nulls_last=True,
+        descending=[True, True, False, False],
+    )
+    return df.with_row_index("Index", offset=1)
+
+
+def eager_chain(raw_df, query):
+    df = eager_choice(raw_df, query.choice)
+    df = eager_areas(df, query.areas)
+    df = eager_search(df, query.search_query)
+    df = eager_categories(df, query.categories)
+    return eager_sort(df)
+
+
+if __name__ == "__main__":
+    dataset = get_dataset()
+    raw_df = read_investments().drop("Index")
+    indexes = QueryIndexes(
+        search=get_search_index(dataset),
+        bit_values=dataset.bit_values,
+        areas=get_area_index(dataset),
+        isins=get_isin_index(dataset),
+    )
+
+    print(f"{'':36} {'eager chain':>16} {'lazy plan':>16} {'lazy + indexes':>16}")
+    for name, query in QUERIES:
+        eager_ms, eager_df = best_of(lambda: eager_chain(raw_df, query), repeat=3)
+        plan_ms, plan_df = best_of(lambda: query.collect(dataset.df))
+        index_ms, index_df = best_of(lambda: query.collect(dataset.df, indexes))
+        print(
+            f"{name:36} {eager_ms:9.1f} ms {eager_df.height:>5} "
+            f"{plan_ms:9.1f} ms {plan_df.height:>5} {index_ms:9.1f} ms {index_df.height:>5}"
+        )
+
+    print()
+    print(QUERIES[-1][1].explain(dataset.df))
@@ -0,0 +1,73 @@
+# Searches through the inverted token index against scans of the table, on the national table.
+# The target is under 10 ms per search through the index.
+import time
+
+import numpy as np
+import polars as pl
+from common import best_of
+from query_plan import eager_search
+from utils.dataset import get_dataset
+from utils.query import SEARCH_COLUMNS, normalize_expr, search_expr
+from utils.search import SearchIndex
+from utils.synonyms import SYNONYMS
+
+# Whole words, parts of words, phrases and words with synonyms. 'arm' is part of the synonym
+# 'arms' and must only find the rows containing it.
+SEARCH_QUERIES = [
+    "bank",
+    "tob",
+    "menneskerettigheder",
+    "corp",
+    "excluded due to",
+    "x",
+    "arm",
+    "kina",
+]
+
+
+def synonym_expr(search_query):
+    """
+    Predicate for the rows where a searchable column has a word that the query is a synonym
+    of, which the index also finds.
+    """
+    words = [word for group in SYNONYMS if search_query in group for word in group]
+    return pl.any_horizontal(
+        pl.lit(False),
+        *(
+            pl.concat_str(
+                pl.lit(" "), normalize_expr(pl.col(column).cast(pl.Utf8).fill_null("")), pl.lit(" ")
+            ).str.contains(f" {word} ", literal=True)
+            for column in SEARCH_COLUMNS
+            for word in words
+            if word != search_query
+        ),
+    )
+
+
+if __name__ == "__main__":
+    df = get_dataset().df
+
+    started = time.perf_counter()
+    index = SearchIndex(df)
+    print(f"Building the index took {time.perf_counter() - started:.2f}s for {df.height} rows")
+    print()
+
+    print(f"{'':22} {'regex scan':>19} {'column scan':>19} {'index':>19}")
+    for search_query in SEARCH_QUERIES:
+        # The scan the pages ran before the index, of every column cast to strings
+        regex_ms, regex_df = best_of(lambda: eager_search(df, search_query), repeat=3)
+        # The scan of the searchable columns, which queries without the index still run, and
+        # of the words the query is a synonym of
+        scan_ms, scan_mask = best_of(
+            lambda: df.select(
+                search_expr(SEARCH_COLUMNS, search_query) | synonym_expr(search_query)
+            )
+            .to_series()
+            .to_numpy()
+        )
+        index_ms, index_mask = best_of(lambda: index.search(search_query))
+        assert np.array_equal(scan_mask, index_mask), search_query
+        print(
+            f"{search_query:22} {regex_ms:9.1f} ms {regex_df.height:>6} "
+            f"{scan_ms:9.1f} ms {scan_mask.sum():>6} {index_ms:9.1f} ms {index_mask.sum():>6}"
+        )
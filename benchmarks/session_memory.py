@@ -0,0 +1,132 @@
+# Resident memory of the app server as the number of concurrent sessions grows. The front page is
+# served by a real Streamlit server, and every session is a websocket client in its own thread
+# that runs the page and stays connected. All sessions share the one dataset, so memory should
+# stay flat. Exits with 1 if a session adds more than MAX_MB_PER_SESSION on average.
+#
+# AppTest cannot be used here, as it swaps Streamlit's global runtime for every run, so sessions
+# in threads would tear down each other's runtime.
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+from common import memory_mb
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from utils.dataset import get_dataset
+from websockets.sync.client import connect
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FRONT_PAGE = os.path.join(ROOT, "webapp", "Forside.py")
+
+SESSION_COUNTS = [1, 10, 50, 100, 200]
+
+# The memory a session may add, far below a copy of the dataset per session
+MAX_MB_PER_SESSION = 1.0
+
+# How long the server and a run of the page may take, in seconds
+TIMEOUT = 600
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    """
+    The front page served by Streamlit in a new process, once it answers health checks.
+    """
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", FRONT_PAGE]
+        + ["--server.headless", "true", "--server.port", str(port)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health")
+            return server
+        except OSError:
+            time.sleep(1)
+    server.kill()
+    raise RuntimeError("The server did not start")
+
+
+def run_page(websocket):
+    """
+    Run the page in the session, and return the first exception it showed, or None.
+    """
+    message = BackMsg()
+    message.rerun_script.query_string = ""
+    websocket.send(message.SerializeToString())
+
+    error = None
+    while True:
+        message = ForwardMsg()
+        message.ParseFromString(websocket.recv(timeout=TIMEOUT))
+        if message.WhichOneof("type") == "script_finished":
+            return error
+        element = message.delta.new_element
+        if error is None and element.WhichOneof("type") == "exception":
+            error = element.exception.message
+
+
+def session(port, ready, close):
+    """
+    A session on the server that runs the page, reports to ready and stays open until close.
+    """
+    try:
+        with connect(
+            f"ws://127.0.0.1:{port}/_stcore/stream",
+            subprotocols=["streamlit"],
+            open_timeout=TIMEOUT,
+            ping_interval=None,
+            max_size=None,
+        ) as websocket:
+            ready.put(run_page(websocket))
+            close.wait()
+    except Exception as e:
+        ready.put(repr(e))
+
+
+if __name__ == "__main__":
+    port = free_port()
+    server = start_server(port)
+    ready, close = queue.Queue(), threading.Event()
+    try:
+        baseline = None
+        for count in SESSION_COUNTS:
+            opened = threading.active_count() - 1
+            for _ in range(count - opened):
+                threading.Thread(target=session, args=(port, ready, close), daemon=True).start()
+            errors = [ready.get(timeout=TIMEOUT) for _ in range(count - opened)]
+            errors = [error for error in errors if error is not None]
+            if errors:
+                raise RuntimeError(errors[0])
+
+            rss = memory_mb("VmRSS", server.pid)
+            baseline = baseline or rss
+            per_session = (rss - baseline) / count
+            print(
+                f"{count:>4} sessions: {rss:7.1f} MB RSS "
+                f"({rss - baseline:+.1f} MB, {per_session:.2f} MB per session)"
+            )
+    finally:
+        close.set()
+        server.terminate()
+        server.wait()
+
+    # What every session would add if it held its own copy of the data
+    print(f"The shared dataset holds {get_dataset().df.estimated_size() / 1e6:.1f} MB")
+
+    if per_session > MAX_MB_PER_SESSION:
+        print(f"A session adds more than {MAX_MB_PER_SESSION} MB")
+        sys.exit(1)
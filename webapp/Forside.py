@@ -1,29 +1,25 @@
 import streamlit as st
-import polars as pl
 import os
 import sys
 from utils.data_processing import (
-    get_data,
     get_unique_kommuner,
     get_unique_categories,
-    filter_dataframe_by_choice,
-    filter_dataframe_by_category,
+    aggregate_query,
     generate_organization_links,
-    filter_df_by_search,
-    fix_column_types_and_sort,
     format_number_european,
     round_to_million_or_billion,
     get_ai_text,
-    to_excel_function,
     load_css,
     write_markdown_sidebar,
-    format_and_display_data,
     display_dataframe,
     create_user_session_log,
-    cache_data_for_hele_landet,
-    cache_excel_for_hele_landet,
+    download_buttons,
+    get_filtered_df,
 )
-from utils.plots import create_pie_chart
+from utils.plots import get_pie_chart
+from utils.cube import key_figures
+from utils.dataset import get_dataset
+from utils.query import InvestmentQuery
 from config import set_pandas_options, set_streamlit_options
 
 # Apply the settings
@@ -35,7 +31,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 
 create_user_session_log("Forside")
 
-df_pl = get_data()
+# Fetch the dataset once, so the whole run uses the same version of the data
+dataset = get_dataset()
 
 st.logo(
     "webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png", link="https://gravercentret.dk/"
@@ -97,7 +94,7 @@ st.markdown(
             Gravercentret, Danmarks Center for Undersøgende Journalistik, har sammen med Danwatch undersøgt, hvilke værdipapirer de danske kommuner og regioner har valgt at investere i. \n
             Vi har kortlagt, hvilke værdipapirer der ligger nede i de investeringsfonde og investeringsforeninger, som kommunerne og regionerne har sat deres penge i.
             Disse oplysninger har vi sammenholdt med lister over hvilke værdipapirer, der er sortlistet af danske banker og pensionsselskaber samt FN. \n
-            Herunder kan du se oplysninger fra alle kommuner og regioner – og du kan downloade oplysningerne i Excel-format.
+            Herunder kan du se oplysninger fra alle kommuner og regioner – og du kan downloade oplysningerne i Excel-, CSV- eller Parquet-format.
             I den lyseblå kolonne til venstre kan du søge i data.\n
             *OBS: Den 13/12/24 har vi fjernet selskabet Daiichi Sankyo Co. Ltd. fra problemkategorien "Gambling", da selskabet var blevet fejlmatchet med selskabet Sankyo Co. Ltd. Den 24/10, er data opdateret, da vi har fundet flere statsobligationer, der ikke var markeret fra start, og d. 07/11 er data opdateret, da markedsværdierne for nogle af Odense Kommunes værdipapirer er tilrettet.*
 
@@ -119,7 +116,7 @@ with st.expander("🟥🟧🟨 - Læs mere: Hvordan skal tallene forstås?"):
                 Ved at scrolle til højre i skemaet kan man se en anden kolonne, der hedder ”sortlistet”. Her kan man se, hvor mange sorte lister fra danske banker, pensionsselskaber og FN det pågældende værdipapir er på. Står der eksempelvis 5, så er værdipapiret altså sortlistet af fem forskellige parter.\n
                 Som tommelfingerregel kan man sige, at jo flere sorte lister et bestemt værdipapir er på, jo mere problematisk er det.\n
                 I tabellen kan du også se, hvilken type værdipapiret er (f.eks. aktie eller obligation), værdipapirets ISIN-nummer (et unikt nummer ligesom et CPR-nummer), samt hvem der har udstedt papiret.\n
-                Data kan downloades til Excel neden under tabellen.
+                Data kan downloades til Excel, CSV og Parquet neden under tabellen.
                 """
     )
     st.markdown(
@@ -143,10 +140,10 @@ with st.expander("Sådan kommer du i gang.", icon="❔"):
     )
 
 # Get unique municipalities and sort alphabetically
-dropdown_options = get_unique_kommuner(df_pl)
+dropdown_options = get_unique_kommuner(dataset)
 
 # Get list of categories/reasons
-unique_categories_list = get_unique_categories(df_pl)
+unique_categories_list = get_unique_categories(dataset)
 
 # Costum choice for dropdown
 all_values = "Hele landet"
@@ -182,23 +179,28 @@ with st.sidebar:
         unsafe_allow_html=True,
     )
 
-    # Filter dataframe based on user's selection
-    filtered_df = filter_dataframe_by_choice(df_pl, user_choice)
+    query = InvestmentQuery(
+        choice=user_choice,
+        categories=tuple(selected_categories),
+        search_query=search_query,
+    ).canonical()
 
-    filtered_df = filter_df_by_search(filtered_df, search_query)
+    # Filter dataframe based on user's selection in a single query plan, or reuse the rows of
+    # any session that made the same selection. "Hele landet" is precomputed at start-up.
+    filtered_df = get_filtered_df(dataset, query)
 
-    filtered_df = filter_dataframe_by_category(filtered_df, selected_categories)
-
-    filtered_df = fix_column_types_and_sort(filtered_df)
+    # The pie chart and key figures are answered from aggregated cells
+    cells = aggregate_query(dataset, query, filtered_df)
+    figures = key_figures(cells)
 
     if user_choice in [all_values, municipalities, regions] and search_query or selected_categories:
         if search_query:
             st.markdown(
-                f"Antal kommuner/regioner, hvor '{search_query}' indgår: \n **{filtered_df.select(pl.col('Område').n_unique()).to_numpy()[0][0]}**"
+                f"Antal kommuner/regioner, hvor '{search_query}' indgår: \n **{figures['Områder']}**"
             )
         else:
             st.markdown(
-                f"Antal kommuner/regioner, der fremgår efter filtrering: \n **{filtered_df.select(pl.col('Område').n_unique()).to_numpy()[0][0]}**"
+                f"Antal kommuner/regioner, der fremgår efter filtrering: \n **{figures['Områder']}**"
             )
 
     write_markdown_sidebar()
@@ -225,10 +227,10 @@ col1, col2 = st.columns([0.4, 0.6])
 
 # Column 1: Pie chart for "Type" based on "Markedsværdi (DKK)"
 with col1:
-    if filtered_df.shape[0] == 0:
+    if figures["Antal investeringer"] == 0:
         st.subheader(f"**Der er ingen værdipapirer/investeringer.**")
     else:
-        create_pie_chart(filtered_df)
+        st.plotly_chart(get_pie_chart(dataset, query, cells))
 
 # Column 2: Number of problematic investments
 with col2:
@@ -239,19 +241,15 @@ with col2:
             unsafe_allow_html=True,
         )
 
-        # Count the rows where 'Problematisk ifølge:' is not empty
-        problematic_count = filtered_df.filter(filtered_df["Priority"].is_in([2, 3])).shape[0]
-        problematic_count = format_number_european(problematic_count)
+        # Count the problematic investments (Priority 2 and 3)
+        problematic_count = format_number_european(figures["Problematiske"])
         st.markdown(
             f"<h2 style='text-align:center;'>{problematic_count}</h2>",
             unsafe_allow_html=True,
         )
 
-        problematic_count_red = filtered_df.filter(filtered_df["Priority"] == 3).shape[0]
-        problematic_count_red = format_number_european(problematic_count_red)
-
-        problematic_count_orange = filtered_df.filter(filtered_df["Priority"] == 2).shape[0]
-        problematic_count_orange = format_number_european(problematic_count_orange)
+        problematic_count_red = format_number_european(figures["Sortlistede selskaber"])
+        problematic_count_orange = format_number_european(figures["Sortlistede statsobligationer"])
 
         # Using HTML to style text with color
         st.markdown(
@@ -260,8 +258,7 @@ with col2:
             unsafe_allow_html=True,
         )
 
-        problematic_count_yellow = filtered_df.filter(filtered_df["Priority"] == 1).shape[0]
-        problematic_count_yellow = format_number_european(problematic_count_yellow)
+        problematic_count_yellow = format_number_european(figures["Potentielt problematiske"])
 
         # Using HTML to style text with color
         st.markdown(" ")
@@ -275,24 +272,19 @@ with col2:
         st.subheader("Nøgletal")
 
         # Calculate the total number of investments
-        antal_inv = format_number_european(len(filtered_df))
+        antal_inv = format_number_european(figures["Antal investeringer"])
 
         st.write(f"**Antal investeringer:** {antal_inv}")
 
         # Calculate the total sum of 'Markedsværdi (DKK)' and display it in both DKK and millions
-        total_markedsvaerdi = (
-            filtered_df.select(pl.sum("Markedsværdi (DKK)")).to_pandas().iloc[0, 0]
-        ).astype(int)
+        total_markedsvaerdi = int(figures["Markedsværdi"])
 
         markedsvaerdi_euro = format_number_european(total_markedsvaerdi)
         markedsvaerdi_euro_short = round_to_million_or_billion(total_markedsvaerdi, 1)
         st.write(f"**Total markedsværdi (DKK):** {markedsvaerdi_euro} {markedsvaerdi_euro_short}")
 
-        # Filter for problematic investments and calculate the total sum of their 'Markedsværdi (DKK)'
-        prob_df = filtered_df.filter(filtered_df["Priority"].is_in([2, 3]))
-        prob_markedsvaerdi = (
-            prob_df.select(pl.sum("Markedsværdi (DKK)")).to_pandas().iloc[0, 0]
-        ).astype(int)
+        # The total sum of the problematic investments' 'Markedsværdi (DKK)'
+        prob_markedsvaerdi = int(figures["Problematisk markedsværdi"])
 
         prob_markedsvaerdi_euro = format_number_european(prob_markedsvaerdi)
         prob_markedsvaerdi_euro_short = round_to_million_or_billion(prob_markedsvaerdi, 1)
@@ -301,52 +293,21 @@ with col2:
         )
 
 with st.spinner("Henter data.."):
-    if user_choice == "Hele landet" and selected_categories == [] and search_query == "":
-        # Cache the data for "Hele landet"
-        hele_landet_data = cache_data_for_hele_landet(filtered_df)
-        display_dataframe(hele_landet_data)
-    else:
-        # No caching for other cases
-        display_df = format_and_display_data(filtered_df)
-        display_dataframe(display_df)
+    display_dataframe(dataset, query, filtered_df)
 
 
 st.markdown(
     "\\* *Markedsværdien (DKK) er et øjebliksbillede. Tallene er oplyst af kommunerne og regionerne selv ud fra deres senest opgjorte opgørelser.*"
 )
 
-generate_organization_links(filtered_df, "Problematisk ifølge:")
+generate_organization_links(dataset, filtered_df, "Problematisk ifølge:")
 st.markdown(
     '**Mere om værdipapirer udpeget af Gravercentret:** <a href="/Mulige_historier" target="_self">Mulige historier</a>',
     unsafe_allow_html=True,
 )
 
-filtered_df = filtered_df.to_pandas()
-filtered_df.drop("Priority", axis=1, inplace=True)
-
-
-with st.spinner("Klargør download til Excel.."):
-    if user_choice == "Hele landet" and selected_categories == [] and search_query == "":
-        # Cache and create the Excel file for "Hele landet"
-        hele_landet_excel = cache_excel_for_hele_landet(filtered_df)
-
-        # Create a download button for the Excel file
-        st.download_button(
-            label="Download til Excel",
-            data=hele_landet_excel,
-            file_name=f"Investeringer for {user_choice}{search_query}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
-    else:
-        excel_data = to_excel_function(filtered_df)
-
-        # Create a download button
-        st.download_button(
-            label="Download til Excel",
-            data=excel_data,
-            file_name=f"Investeringer for {user_choice}{search_query}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+# Create the download buttons, with CSV and Parquet next to the Excel file
+download_buttons(dataset, query, filtered_df, f"Investeringer for {user_choice}{search_query}")
 
 with st.spinner("Henter AI-tekster.."):
     if user_choice not in [all_values, municipalities, regions, samsø, læsø]:
@@ -358,6 +319,6 @@ with st.spinner("Henter AI-tekster.."):
             icon="ℹ️",
         )
 
-        ai_text = get_ai_text(user_choice)
+        ai_text = get_ai_text(dataset, user_choice)
 
         st.markdown(ai_text)
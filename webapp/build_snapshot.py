@@ -0,0 +1,7 @@
+# Compile the SQLite database into the columnar snapshot read by the app.
+# Run from the repository root: python webapp/build_snapshot.py
+from utils.snapshot import SNAPSHOT_PATH, build_snapshot
+
+if __name__ == "__main__":
+    snapshot = build_snapshot()
+    print(f"Wrote {snapshot.height} rows to {SNAPSHOT_PATH}")
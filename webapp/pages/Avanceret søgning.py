@@ -1,22 +1,22 @@
 import streamlit as st
 import polars as pl
 from utils.data_processing import (
-    get_data,
-    filter_df_by_search,
-    fix_column_types_and_sort,
+    get_area_ranking,
     format_number_european,
     round_to_million_or_billion,
     get_unique_categories,
     get_unique_kommuner,
-    filter_dataframe_by_category,
-    filter_dataframe_by_multiple_choices,
-    to_excel_function,
     load_css,
     write_markdown_sidebar,
     create_user_session_log,
     generate_organization_links,
     display_dataframe,
+    download_buttons,
+    get_filtered_df,
 )
+from utils.dataset import get_dataset
+from utils.isin import find_isins
+from utils.query import InvestmentQuery
 from config import set_pandas_options, set_streamlit_options
 from datetime import datetime
 
@@ -30,7 +30,8 @@ st.logo("webapp/images/GC_png_oneline_lockup_Outline_Blaa_RGB.png", link="https:
 
 load_css("webapp/style.css")
 
-df_pl = get_data()
+# Fetch the dataset once, so the whole run uses the same version of the data
+dataset = get_dataset()
 
 with st.sidebar:
     write_markdown_sidebar()
@@ -39,9 +40,9 @@ with st.sidebar:
 st.header("Søg videre i databasen")
 
 default_priorities = [2, 3]
-unique_categories_list = get_unique_categories(df_pl)
+unique_categories_list = get_unique_categories(dataset)
 
-dropdown_areas = get_unique_kommuner(df_pl)
+dropdown_areas = get_unique_kommuner(dataset)
 
 to_be_removed = {"Alle kommuner", "Alle regioner", "Hele landet"}
 dropdown_areas = [item for item in dropdown_areas if item not in to_be_removed]
@@ -49,6 +50,30 @@ dropdown_areas = [item for item in dropdown_areas if item not in to_be_removed]
 col1, col2 = st.columns(2)
 with col1:
     search_query = st.text_input("Fritekst søgning i data:", "")
+    fuzzy_search = st.toggle(
+        "Tillad stavefejl",
+        help="Finder også ord, der staves næsten som søgningen. De bedste match vises først.",
+    )
+
+    with st.expander("Søg på en liste af ISIN-koder"):
+        pasted_isins = st.text_area(
+            "Indsæt ISIN-koder:",
+            help="Adskil koderne med mellemrum, komma, semikolon eller linjeskift.",
+        )
+        uploaded_isins = st.file_uploader(
+            "Eller upload en fil med ISIN-koder:", type=["txt", "csv"]
+        )
+    isin_text = pasted_isins
+    if uploaded_isins is not None:
+        isin_text += "\n" + uploaded_isins.getvalue().decode("utf-8", errors="ignore")
+    isin_list, invalid_isins = find_isins(isin_text)
+    if invalid_isins:
+        st.warning(
+            "Disse ISIN-koder har et forkert kontrolciffer og er ikke med i søgningen: "
+            + ", ".join(invalid_isins)
+        )
+    if isin_list:
+        st.caption(f"Søger på {len(isin_list)} ISIN-koder.")
 
     selected_priorities = st.multiselect(
         "Vælg type(r):",
@@ -75,6 +100,10 @@ with col2:
         help="Vi har grupperet de mange årsager til eksklusion i hovedkategorier. Vælg én eller flere.",
         placeholder="Vælg problemkategori.",
     )
+    all_categories = st.toggle(
+        "Kræv alle valgte kategorier",
+        help="Vis kun værdipapirer, der hører under alle de valgte problemkategorier, i stedet for blot én af dem.",
+    )
 
 
 with st.expander("Om søgeværktøjet (klik for at folde ud eller ind)", expanded=True):
@@ -88,9 +117,11 @@ with st.expander("Om søgeværktøjet (klik for at folde ud eller ind)", expande
                     så er de to relevante grupper tilføjet fra start som standard.\n
     Herefter kan du fritekstsøge og/eller vælge kategorier af problematiske papirer. Vær opmærksom på:
 
-    - **Sprogforskelle:** Søgeværktøjet skelner mellem forskellige sprog. For eksempel vil en søgning på 'Kina' ikke give resultater for 'China'. Sørg derfor for at prøve flere varianter af søgeord.
+    - **Sprogforskelle:** Søgeværktøjet kender de danske og engelske navne på en række lande og selskaber. For eksempel vil en søgning på 'Kina' også give resultater for 'China'. Finder du ikke det, du leder efter, så prøv flere varianter af søgeord.
+    - **Stavefejl:** Slå 'Tillad stavefejl' til for også at finde ord, der staves næsten som din søgning. De bedste match vises så først.
+    - **ISIN-koder:** Søger du på en enkelt ISIN-kode, finder du præcis de værdipapirer, der har koden. Har du mange koder, kan du indsætte eller uploade dem alle under 'Søg på en liste af ISIN-koder'.
     - **Eksperimentér med søgeord:** Hvis du ikke finder det, du leder efter med det samme, så prøv forskellige formuleringer eller delord af det, du søger.
-    - **Download data:** Ønsker du at downloade top 10? Brug download-ikonet, som findes øverst i tabellen. I bunden er der en download-knap for det fulde data baseret på de valg, der er taget.
+    - **Download data:** Ønsker du at downloade top 10? Brug download-ikonet, som findes øverst i tabellen. I bunden er der download-knapper (Excel, CSV og Parquet) for det fulde data baseret på de valg, der er taget.
             """
     )
 
@@ -106,43 +137,26 @@ with st.expander("Disse områder har ingen problematiske investeringer:"):
     )
 
 
-# Filter the dataframe by selected priorities and search query
-filtered_df = (
-    df_pl.filter(
-        (df_pl["Priority"].is_in([p for p in selected_priorities if p is not None]))
-        | (df_pl["Priority"].is_null())
-    )
-    if None in selected_priorities
-    else df_pl.filter(df_pl["Priority"].is_in(selected_priorities))
-)
+# Filter the dataframe by selected priorities, areas, categories and search query in a single query plan
+query = InvestmentQuery(
+    areas=tuple(selected_areas),
+    priorities=tuple(selected_priorities),
+    categories=tuple(selected_categories),
+    all_categories=all_categories,
+    search_query=search_query,
+    fuzzy=fuzzy_search,
+    isins=tuple(isin_list),
+).canonical()
+filtered_df = get_filtered_df(dataset, query)
 
-filtered_df = filter_dataframe_by_multiple_choices(filtered_df, selected_areas)
-filtered_df = filter_df_by_search(filtered_df, search_query)
-filtered_df = filter_dataframe_by_category(filtered_df, selected_categories)
-filtered_df = fix_column_types_and_sort(filtered_df)
 
+# Both rankings are computed once per filter state, so switching views costs nothing
+ranking = get_area_ranking(dataset, query, filtered_df)
 
-# Function to get either top 10 municipalities or the full list based on market value or count
-def get_municipalities(filtered_df, sort_by_col, top_n=None):
-    kommune_summary = (
-        filtered_df.group_by("Område")
-        .agg(
-            [
-                pl.len().alias("Antal investeringer"),
-                pl.sum("Markedsværdi (DKK)").alias("Total Markedsværdi (DKK)"),
-            ]
-        )
-        .sort(sort_by_col, descending=True)
-        .with_row_index("Placering")  # Add index column called 'Placering'
-        .with_columns((pl.col("Placering") + 1).alias("Placering"))
-    )
 
-    # Format the 'Total Markedsværdi (DKK)' column to European formatting
-    kommune_summary = kommune_summary.with_columns(
-        pl.col("Total Markedsværdi (DKK)").map_elements(
-            format_number_european, return_dtype=pl.Utf8
-        )
-    )
+# Function to get either top 10 municipalities or the full list based on market value or count
+def get_municipalities(sort_by_col, top_n=None):
+    kommune_summary = ranking[sort_by_col]
 
     # If top_n is set, return only the top_n rows
     if top_n:
@@ -166,12 +180,10 @@ col_sum, col_count = st.columns(2)
 
 with col_sum:
     if view_option == "Top 10":
-        top_municipalities_sum = get_municipalities(
-            filtered_df, "Total Markedsværdi (DKK)", top_n=10
-        )
+        top_municipalities_sum = get_municipalities("Total Markedsværdi (DKK)", top_n=10)
         st.write("##### Top 10 - størst samlet markedsværdi:")
     else:
-        top_municipalities_sum = get_municipalities(filtered_df, "Total Markedsværdi (DKK)")
+        top_municipalities_sum = get_municipalities("Total Markedsværdi (DKK)")
         st.write("##### Hele listen over kommuner med den største sum:")
 
     st.dataframe(
@@ -182,10 +194,10 @@ with col_sum:
 
 with col_count:
     if view_option == "Top 10":
-        top_municipalities_count = get_municipalities(filtered_df, "Antal investeringer", top_n=10)
+        top_municipalities_count = get_municipalities("Antal investeringer", top_n=10)
         st.write("##### Top 10 - antal af investeringer:")
     else:
-        top_municipalities_count = get_municipalities(filtered_df, "Antal investeringer")
+        top_municipalities_count = get_municipalities("Antal investeringer")
         st.write("##### Hele listen over kommuner med det største antal af investeringer:")
 
     st.dataframe(top_municipalities_count)
@@ -203,7 +215,7 @@ with st.container(border=True):
     investment_sum = filtered_df.select(pl.col("Markedsværdi (DKK)").sum()).to_numpy()[0][0]
 
     # Create the conditional text for the sum
-    if search_query or selected_categories:
+    if search_query or selected_categories or isin_list:
         sum_text = f"***Summen af investeringerne:*** **{format_number_european(investment_sum)} DKK** **{round_to_million_or_billion(investment_sum, 1)}** (Baseret på filtrering) "
     else:
         sum_text = f"***Summen af investeringerne:*** **{format_number_european(investment_sum)} DKK** **{round_to_million_or_billion(investment_sum, 1)}**"
@@ -212,37 +224,20 @@ with st.container(border=True):
     st.markdown(f"{sum_text}")
 
 
-display_df = filtered_df.with_columns(
-    pl.col("Markedsværdi (DKK)")
-    .map_elements(format_number_european, return_dtype=pl.Utf8)
-    .alias("Markedsværdi (DKK)"),
-)
-
-display_dataframe(display_df)
+display_dataframe(dataset, query, filtered_df)
 
 st.markdown(
     "\\* *Markedsværdien (DKK) er et øjebliksbillede. Tallene er oplyst af kommunerne og regionerne selv ud fra deres senest opgjorte opgørelser.*"
 )
 
-generate_organization_links(filtered_df, "Problematisk ifølge:")
+generate_organization_links(dataset, filtered_df, "Problematisk ifølge:")
 st.markdown(
     "**Mere om værdipapirer udpeget af Gravercentret:** <a href='/Mulige_historier' target='_self'>Mulige historier</a>",
     unsafe_allow_html=True,
 )
 
-display_df = display_df.to_pandas()
-display_df.drop("Priority", axis=1, inplace=True)
-
-# Convert dataframe to Excel
-excel_data = to_excel_function(display_df)
-
 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-with st.spinner("Klargør download til Excel.."):
-    # Create a download button
-    st.download_button(
-        label="Download til Excel",
-        data=excel_data,
-        file_name=f"Investeringer-{timestamp}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    )
+# Create the download buttons. The Excel file has the formatted market values like the table,
+# while CSV and Parquet keep them as numbers.
+download_buttons(dataset, query, filtered_df, f"Investeringer-{timestamp}", formatted_excel=True)
@@ -0,0 +1,13 @@
+# Start the Streamlit server after warming up the default "Hele landet" view. The server
+# only starts listening (and reporting healthy) once the warm-up has finished.
+# Usage: python webapp/serve.py <main page> [streamlit run options]
+import sys
+
+from streamlit.web import cli as stcli
+
+from utils.warmup import warm_up
+
+if __name__ == "__main__":
+    warm_up()
+    sys.argv = ["streamlit", "run", *sys.argv[1:]]
+    sys.exit(stcli.main())
@@ -0,0 +1,61 @@
+import numpy as np
+import polars as pl
+
+from utils.dataset import derived_cache
+from utils.query import ALL_VALUES, MUNICIPALITIES, REGION_AREAS, REGIONS
+
+
+class AreaIndex:
+    """
+    The positions of the rows of every area in the dataset, and of the kommune and region
+    groups. Selecting areas gathers their rows instead of comparing every row's area.
+    """
+
+    def __init__(self, df):
+        groups = (
+            df.select(pl.col("Område").cast(pl.Utf8))
+            .with_row_index("Row")
+            .group_by("Område")
+            .agg(pl.col("Row"))
+        )
+        self.rows_by_area = {
+            area: rows.to_numpy() for area, rows in zip(groups["Område"], groups["Row"])
+        }
+        self.empty = np.array([], dtype=np.uint32)
+
+        # The groups are the union of their areas, in the order of the dataset
+        regions = [area for area in self.rows_by_area if area in REGION_AREAS]
+        municipalities = [area for area in self.rows_by_area if area not in REGION_AREAS]
+        self.rows_by_area[REGIONS] = self.union(regions)
+        self.rows_by_area[MUNICIPALITIES] = self.union(municipalities)
+
+    def union(self, areas):
+        rows = [self.rows_by_area[area] for area in areas if area in self.rows_by_area]
+        return np.sort(np.concatenate(rows)) if rows else self.empty
+
+    def rows(self, choice=ALL_VALUES, areas=()):
+        """
+        The positions of the rows in the selected choice and areas (ignoring the custom choices
+        in areas, as areas_expr does), or None if the selection includes every row.
+        """
+        selections = []
+        if choice != ALL_VALUES:
+            selections.append(self.rows_by_area.get(choice, self.empty))
+
+        specific_areas = [
+            area for area in areas if area not in [ALL_VALUES, MUNICIPALITIES, REGIONS]
+        ]
+        if specific_areas:
+            selections.append(self.union(specific_areas))
+
+        if not selections:
+            return None
+        rows = selections[0]
+        for selection in selections[1:]:
+            rows = np.intersect1d(rows, selection)
+        return rows
+
+
+@derived_cache
+def get_area_index(dataset):
+    return AreaIndex(dataset.df)
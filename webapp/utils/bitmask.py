@@ -0,0 +1,102 @@
+import polars as pl
+
+# Multi-valued columns, stored "; "-joined in the database, and the bitmask columns decoded from
+# them when the data loads. Bit i of a row is set if the row has the i-th value of the column.
+BITMASK_COLUMNS = {
+    "Problemkategori": "Problemkategori (bits)",
+    "Problematisk ifølge:": "Problematisk ifølge: (bits)",
+}
+
+# Only used for filtering, so never shown or exported
+INTERNAL_COLUMNS = list(BITMASK_COLUMNS.values())
+
+SEPARATOR = "; "
+
+# The bitmasks are stored as UInt64
+MAX_VALUES = 64
+
+
+def split_values(expr):
+    return expr.str.split(SEPARATOR).list.eval(pl.element().str.strip_chars())
+
+
+def distinct_values(series):
+    """
+    The sorted distinct values of a "; "-joined column, in the order of their bits.
+    """
+    values = (
+        series.to_frame("Values")
+        .select(split_values(pl.col("Values").drop_nulls()).explode().unique())
+        .filter(pl.col("Values") != "")["Values"]
+        .to_list()
+    )
+    if len(values) > MAX_VALUES:
+        raise ValueError(f"{series.name} has {len(values)} values, but a bitmask fits {MAX_VALUES}")
+    return sorted(values)
+
+
+def bit_values(df):
+    """
+    The values of every multi-valued column in the frame, as a mapping from column to values.
+    """
+    return {
+        column: distinct_values(df[column]) for column in BITMASK_COLUMNS if column in df.columns
+    }
+
+
+def value_bits(values, selected):
+    """
+    The bitmask of the selected values. Values without a bit are ignored.
+    """
+    bits = 0
+    for i, value in enumerate(values):
+        if value in selected:
+            bits |= 1 << i
+    return bits
+
+
+def encode_expr(column, values):
+    lookup = {value: 1 << i for i, value in enumerate(values)}
+    return (
+        split_values(pl.col(column))
+        .list.unique()
+        .list.eval(pl.element().replace_strict(lookup, default=0, return_dtype=pl.UInt64))
+        .list.sum()
+        .fill_null(0)
+        .cast(pl.UInt64)
+        .alias(BITMASK_COLUMNS[column])
+    )
+
+
+def encode_bitmasks(df, values):
+    """
+    Add the bitmask columns of the multi-valued columns in the frame, using the bits in values.
+    """
+    return df.with_columns(
+        encode_expr(column, values[column]) for column in BITMASK_COLUMNS if column in df.columns
+    )
+
+
+def any_of_expr(column, values, selected):
+    """
+    Predicate for rows that have any of the selected values in the multi-valued column.
+    """
+    bits = value_bits(values, selected)
+    return (pl.col(BITMASK_COLUMNS[column]) & bits) != 0
+
+
+def all_of_expr(column, values, selected):
+    """
+    Predicate for rows that have all of the selected values in the multi-valued column.
+    """
+    if any(value not in values for value in selected):
+        return pl.lit(False)
+    bits = value_bits(values, selected)
+    return (pl.col(BITMASK_COLUMNS[column]) & bits) == bits
+
+
+def decode_bits(values, bits):
+    """
+    The values whose bits are set.
+    """
+    return [value for i, value in enumerate(values) if bits & (1 << i)]
@@ -0,0 +1,44 @@
+import polars as pl
+
+from utils.bitmask import BITMASK_COLUMNS
+from utils.dataset import derived_cache
+
+# The dimensions of the aggregate cube. The categories are aggregated by their bitmask, so
+# the category filters work on the cube just like on the rows.
+CUBE_DIMENSIONS = ["Område", "Priority", "Type", BITMASK_COLUMNS["Problemkategori"]]
+
+
+def aggregate(df):
+    """
+    The number of investments ('Antal') and the sum of 'Markedsværdi (DKK)' per cell of the
+    cube dimensions, in a single group-by.
+    """
+    return df.group_by(CUBE_DIMENSIONS).agg(
+        pl.len().alias("Antal"),
+        pl.col("Markedsværdi (DKK)").sum(),
+    )
+
+
+# The cube of the whole dataset, computed once per version
+@derived_cache
+def get_cube(dataset):
+    return aggregate(dataset.df)
+
+
+def key_figures(cells):
+    """
+    The figures of the KPI panels, from aggregated cells.
+    """
+    priority = pl.col("Priority")
+    count = pl.col("Antal")
+    value = pl.col("Markedsværdi (DKK)")
+    return cells.select(
+        count.sum().alias("Antal investeringer"),
+        count.filter(priority.is_in([2, 3])).sum().alias("Problematiske"),
+        count.filter(priority == 3).sum().alias("Sortlistede selskaber"),
+        count.filter(priority == 2).sum().alias("Sortlistede statsobligationer"),
+        count.filter(priority == 1).sum().alias("Potentielt problematiske"),
+        value.sum().alias("Markedsværdi"),
+        value.filter(priority.is_in([2, 3])).sum().alias("Problematisk markedsværdi"),
+        pl.col("Område").n_unique().alias("Områder"),
+    ).row(0, named=True)
@@ -1,65 +1,54 @@
 import babel.numbers
-from sqlalchemy import create_engine
+import os
 import polars as pl
-import pandas as pd
 import streamlit as st
-import re
-from io import BytesIO
 import uuid
+from dataclasses import replace
 from datetime import datetime
+from utils.areas import get_area_index
+from utils.bitmask import BITMASK_COLUMNS, INTERNAL_COLUMNS, decode_bits
+from utils.cube import aggregate, get_cube
+from utils.database import read_ai_texts
+from utils.dataset import LAZY_QUERIES, derived_cache, query_cache
+from utils.export import deferred_export, write_csv, write_excel, write_parquet
+from utils.formatting import format_number_expr
+from utils.isin import get_isin_index
+from utils.log import log
+from utils.query import LOG_QUERY_PLANS, InvestmentQuery, QueryIndexes, SEARCH_COLUMNS
+from utils.results import get_result_cache
+from utils.schema import SORT_COLUMNS
+from utils.search import IncrementalSearch, SearchIndex, get_search_index
+
+
+# The results of a query are kept in the result cache, shared by every session and page
+def get_filtered_df(dataset, query):
+    return get_result_cache().get(dataset, query, "rows", lambda: run_query(dataset, query))
+
+
+def get_display_df(dataset, query, filtered_df):
+    return get_result_cache().get(
+        dataset, query, "display", lambda: format_and_display_data(filtered_df)
+    )
 
 
-@st.cache_data(show_spinner="Indlæser data")
-def get_data():
-    engine = create_engine("sqlite:///data/investerings_database.db")
-
-    query = """
-        SELECT [Kommune] AS [Område], [ISIN kode], [Værdipapirets navn], 
-        [Udsteder], [Markedsværdi (DKK)], [Type], 
-        [Problematisk ifølge:], 
-        [Årsag til eksklusion] AS [Eksklusion (Af hvem og hvorfor)], 
-        [Sortlistet],
-        [Problemkategori],
-        [Priority],
-        CASE 
-            WHEN [OBS_Type] = 'red' THEN '🟥(1)'
-            WHEN [OBS_Type] = 'orange' THEN '🟧(2)'
-            WHEN [OBS_Type] = 'yellow' THEN '🟨(3)'
-            ELSE ''
-        END AS OBS
-        FROM kommunale_regioner_investeringer;
-    """
-
-    # Execute the query and load the result into a Polars DataFrame
-    with engine.connect() as conn:
-        df_polars = pl.read_database(query, conn)
-
-    return df_polars
-
-
-# Cache the data formatting and display function with _ to skip hashing the dataframe
-@st.cache_data
-def cache_data_for_hele_landet(_filtered_df):
-    return format_and_display_data(_filtered_df)
-
+def get_export(dataset, query, part, write, df):
+    # An export file of the rows of a query, built with write(df)
+    return get_result_cache().get(dataset, query, part, lambda: write(df))
 
-# Cache the Excel generation function with _ to skip hashing the dataframe
-@st.cache_data
-def cache_excel_for_hele_landet(_filtered_df):
-    return to_excel_function(_filtered_df)
 
+# All AI summaries are loaded in one query and kept in memory, so choosing an area never
+# touches the database. They are reloaded with every new version of the dataset.
+@derived_cache
+def get_ai_texts(dataset):
+    return read_ai_texts()
 
-def get_ai_text(area):
-    engine = create_engine("sqlite:///data/investerings_database.db") 
-    with engine.connect() as conn:
-        query = f"SELECT [Resumé] FROM kommunale_regioner_ai_tekster WHERE `Kommune` = '{area}';"  # Example query
 
-        # Execute the query and load the result into a Polars DataFrame
-        result_df = pd.read_sql(query, conn)
-    return result_df["Resumé"][0]
+def get_ai_text(dataset, area):
+    return get_ai_texts(dataset).get(area, "")
 
 
-# Define a function to format numbers with European conventions
+# Define a function to format numbers with European conventions. Columns are formatted with
+# format_number_expr from utils.formatting instead, which gives the same output.
 def format_number_european(value, digits=0):
     value = round(value, digits)
     return babel.numbers.format_decimal(value, locale="da_DK")
@@ -84,11 +73,12 @@ def round_to_million_or_billion(value, digits=2):
         return ""
 
 
-def get_unique_kommuner(df_pl):
+@derived_cache
+def get_unique_kommuner(dataset):
     """
     Extract unique 'Kommune' values from the dataframe and sort them alphabetically.
     """
-    unique_kommuner = sorted(df_pl["Område"].unique().to_list())
+    unique_kommuner = list(dataset.areas)
     # Define custom categories
     all_values = "Hele landet"
     municipalities = "Alle kommuner"
@@ -104,159 +94,141 @@ def get_unique_kommuner(df_pl):
     return dropdown_options
 
 
-def get_unique_categories(df_pl):
-    # Create dropdown for 'Problemkategori'
-    unique_categories = df_pl.select(
-        pl.col("Problemkategori")
-        .drop_nulls()  # Drop null values
-        .str.split("; ")  # Split the categories
-        .explode()  # Explode the list into separate rows
-        .unique()  # Get unique values
-    )
-
-    # Convert to a sorted list for a better dropdown experience
-    unique_categories_list = sorted(
-        pl.Series(unique_categories.select("Problemkategori")).to_list()
-    )
-
-    return unique_categories_list
+def get_unique_categories(dataset):
+    # The categories are decoded when the data loads, sorted for a better dropdown experience
+    return list(dataset.bit_values["Problemkategori"])
 
 
-def filter_dataframe_by_choice(
-    df_pl, choice, all_values="Hele landet", municipalities="Alle kommuner", regions="Alle regioner"
-):
+def get_source_data(dataset, query):
     """
-    Filter the dataframe based on the user's selection (all_values, municipalities, regions, or a specific kommune).
+    The frame a query runs against. In the lazy query mode the area, priority and ISIN
+    selections are read directly from SQLite instead of being filtered out of the national table.
     """
-    if choice == all_values:
-        return df_pl
-    elif choice == municipalities:
-        return df_pl.filter(~df_pl["Område"].str.starts_with("Region"))
-    elif choice == regions:
-        return df_pl.filter(df_pl["Område"].str.starts_with("Region"))
-    else:
-        return df_pl.filter(df_pl["Område"] == choice)
-
-
-def filter_dataframe_by_category(df, selected_categories):
-    if selected_categories:
-        # Filter rows where any of the selected categories are in 'Problemkategori'
-        df_filtered = df.filter(
-            pl.col("Problemkategori").map_elements(
-                lambda x: any(cat in x for cat in selected_categories), return_dtype=pl.Boolean
-            )
+    if pushes_down(dataset, query):
+        return dataset.query(
+            areas=query.pushdown_areas(dataset.areas),
+            priorities=query.priorities,
+            isins=list(query.isins) if query.isins else None,
+            columns=QUERY_COLUMNS,
         )
-    else:
-        df_filtered = df
-    return df_filtered
-
-
-def filter_dataframe_by_multiple_choices(
-    df_pl,
-    choices,
-    all_values="Hele landet",
-    municipalities="Alle kommuner",
-    regions="Alle regioner",
-):
-    """
-    Filter the dataframe based on multiple user selections (all_values, municipalities, regions, or specific kommuner).
-    """
-    # Initialize the filters list for storing conditions
-    filters = []
-
-    # Handle specific municipality selections
-    specific_kommuner = [
-        choice for choice in choices if choice not in [all_values, municipalities, regions]
-    ]
-    if specific_kommuner:
-        filters.append(pl.col("Område").is_in(specific_kommuner))
-
-    # Combine all the filters (with logical OR between them)
-    if filters:
-        combined_filter = filters[0]
-        for filter_expr in filters[1:]:
-            combined_filter = combined_filter | filter_expr
-
-        return df_pl.filter(combined_filter)
-    else:
-        return df_pl
+    return dataset.df
+
+
+def pushes_down(dataset, query):
+    # Searches go through search_within or the search index of the national table instead, so
+    # both modes find the same synonyms and typos
+    return (
+        LAZY_QUERIES
+        and not query.search_query
+        and (
+            query.pushdown_areas(dataset.areas) is not None
+            or query.priorities is not None
+            or bool(query.isins)
+        )
+    )
 
 
-def normalize_text(text):
-    # Replace special characters with a single space, collapse multiple spaces, and normalize to lowercase
-    text = re.sub(r"[^\w\s]", " ", text).lower()  # Replace non-alphanumeric characters with space
-    text = re.sub(r"\s+", " ", text).strip()  # Collapse multiple spaces into one and trim
-    return text
+def run_query(dataset, query):
+    if searches_within(dataset, query):
+        return search_within(dataset, query)
 
+    source_df = get_source_data(dataset, query)
 
-def filter_df_by_search(df, search_query):
-    # Use case-insensitive search if query is provided
-    if search_query:
-        # Normalize the search query by removing special characters but keeping spaces normalized
-        normalized_search_query = normalize_text(search_query)
+    # The indexes are built from the national table, so they only apply when the query runs on it
+    indexes = QueryIndexes(bit_values=dataset.bit_values)
+    if not pushes_down(dataset, query):
+        indexes = QueryIndexes(
+            search=get_session_search(get_search_index(dataset)) if query.search_query else None,
+            bit_values=dataset.bit_values,
+            areas=get_area_index(dataset),
+            isins=get_isin_index(dataset),
+        )
 
-        # Replace NA values with empty strings and cast columns to string
-        df = df.with_columns([pl.col(col).fill_null("").cast(str) for col in df.columns])
+    if LOG_QUERY_PLANS:
+        log(f"Query plan for {query}:\n{query.explain(source_df, indexes)}")
+    return query.collect(source_df, indexes)
 
-        # Combine conditions across all columns using logical OR (|) operator
-        filter_expr = None
-        for col in df.columns:
-            # Normalize the text in each column for comparison
-            normalized_col = (
-                pl.col(col)
-                .str.replace_all(r"[^\w\s]", " ")  # Replace non-alphanumeric chars with space
-                .str.to_lowercase()  # Convert to lowercase
-                .str.replace_all(r"\s+", " ")  # Collapse multiple spaces
-                .str.strip_chars()  # Trim leading and trailing spaces
-            )
 
-            # Check if the normalized column contains the normalized search query
-            condition = normalized_col.str.contains(normalized_search_query)
-            filter_expr = condition if filter_expr is None else filter_expr | condition
+def searches_within(dataset, query):
+    # In the lazy query mode a search in selected areas only indexes their rows, while the
+    # national views search the index of the national table
+    return (
+        LAZY_QUERIES
+        and bool(query.search_query)
+        and query.pushdown_areas(dataset.areas) is not None
+    )
 
-        # Apply the filter
-        filtered_df = df.filter(filter_expr)
 
-    else:
-        filtered_df = df
+def search_within(dataset, query):
+    """
+    Search the rows of the other selections of a query, read from SQLite, through a search
+    index of only those rows. The rows and their index are kept in the result cache, so every
+    search within the same selections reuses them.
+    """
+    selection = replace(query, search_query="", fuzzy=False)
+    rows = get_filtered_df(dataset, selection)
+    index = get_result_cache().get(dataset, selection, "search_index", lambda: SearchIndex(rows))
 
-    return filtered_df
+    search = InvestmentQuery(search_query=query.search_query, fuzzy=query.fuzzy)
+    return search.collect(rows, QueryIndexes(search=get_session_search(index)))
 
 
-# Function to check if a value can be converted to float
-def to_float_safe(val):
-    try:
-        return float(val)
-    except ValueError:
-        return None
+def get_session_search(index):
+    """
+    The search index, through the session's IncrementalSearch so a search that refines the
+    session's previous one only looks at the rows that one matched.
+    """
+    if not st.runtime.exists():
+        return index
 
+    search = st.session_state.get("incremental_search")
+    if search is None or search.index is not index:
+        search = st.session_state["incremental_search"] = IncrementalSearch(index)
+    return search
 
-def fix_column_types_and_sort(df):
-    # Cast 'Markedsværdi (DKK)' back to float
-    df = df.with_columns([pl.col("Markedsværdi (DKK)").cast(pl.Float64)])
 
-    # Cast 'Sortlistet' to integer
-    df = df.with_columns([pl.col("Sortlistet").cast(pl.Int32)])
+def aggregate_query(dataset, query, filtered_df):
+    """
+    The aggregated cells of the rows of a query. Without a free-text search the query is run
+    on the precomputed cube, and otherwise its rows are aggregated in a single group-by.
+    """
+    if query.search_query or query.isins or pushes_down(dataset, query):
+        return aggregate(filtered_df)
+    return query.collect(get_cube(dataset), QueryIndexes(bit_values=dataset.bit_values))
 
-    # Apply the function - to_float_safe -to the column
-    df = df.with_columns(pl.col("Priority").map_elements(to_float_safe, return_dtype=pl.Float64))
 
-    # Sort first by 'Sortlistet', then by 'Priority', followed by 'Kommune' and 'ISIN kode'
-    filtered_df = df.sort(
-        ["Sortlistet", "Priority", "Område", "ISIN kode"],
-        nulls_last=True,
-        descending=[True, True, False, False],
+@query_cache
+def get_area_ranking(dataset, query, _filtered_df):
+    """
+    Rank the areas by the total market value and by the number of investments of a query,
+    from a single aggregation. Returns the full rankings by their sort column, with the
+    'Placering' rank and the formatted 'Total Markedsværdi (DKK)'.
+    """
+    summary = (
+        aggregate_query(dataset, query, _filtered_df)
+        .group_by("Område")
+        .agg(
+            pl.col("Antal").sum().alias("Antal investeringer"),
+            pl.col("Markedsværdi (DKK)").sum().alias("Total Markedsværdi (DKK)"),
+        )
     )
 
-    filtered_df = filtered_df.with_row_index("Index", offset=1)
-
-    # filtered_df = filtered_df.rename({"Årsag til eksklusion": "Eksklusion (Af hvem og hvorfor)"})
-
-    return filtered_df
+    rankings = {}
+    for sort_by_col in ["Total Markedsværdi (DKK)", "Antal investeringer"]:
+        # Ties are ordered by area, so the ranking is the same on every run
+        rankings[sort_by_col] = summary.sort(
+            [sort_by_col, "Område"], descending=[True, False]
+        ).with_row_index("Placering", offset=1)
+
+    # Format the sums once, after sorting on the numbers
+    return {
+        sort_by_col: ranking.with_columns(format_number_expr(pl.col("Total Markedsværdi (DKK)")))
+        for sort_by_col, ranking in rankings.items()
+    }
 
 
 # Function to generate a single line with links
-def generate_organization_links(df, column_name):
+def generate_organization_links(dataset, df, column_name):
     org_links = {
         "Akademiker Pension": "https://akademikerpension.dk/ansvarlighed/frasalg-og-eksklusion/",
         "AP Pension": "https://appension.dk/globalassets/content_mz/filer-pdf/investering/eksklusionsliste.pdf",
@@ -282,14 +254,9 @@ def generate_organization_links(df, column_name):
         "Sydinvenst": "https://www.sydinvest.dk/investeringsforening/ansvarlighed/eksklusionsliste-selskaber",
         "Velliv": "https://www.velliv.dk/dk/privat/om-os/samfundsansvar/ansvarlige-investeringer/vores-holdninger",  # "https://www.velliv.dk/media/5102/eksklusionslisten-31012024.pdf",
     }
-    # Extract all unique organizations from the dataframe column
-    unique_orgs = set()
-
-    for org_list in df[column_name]:
-        if org_list is not None:
-            orgs = org_list.split("; ")
-            for org in orgs:
-                unique_orgs.add(org.strip())
+    # Extract all unique organizations from the bitmask of the column, combined over every row
+    bits = df.select(pl.col(BITMASK_COLUMNS[column_name]).bitwise_or()).item() or 0
+    unique_orgs = decode_bits(dataset.bit_values[column_name], bits)
 
     # Generate the links as one line
     links = "; ".join([f"[{org}]({org_links[org]})" for org in unique_orgs if org in org_links])
@@ -298,13 +265,56 @@ def generate_organization_links(df, column_name):
     st.markdown(f"**Links til seneste relevante eksklusionslister:** {links}")
 
 
+def export_frame(df):
+    # 'Priority' and the bitmask columns are only used for sorting and filtering
+    return df.drop("Priority", *INTERNAL_COLUMNS, strict=False)
+
+
 # Function to convert dataframe to Excel and create a downloadable file
 def to_excel_function(filtered_df):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        filtered_df.to_excel(writer, index=False)
-    processed_data = output.getvalue()
-    return processed_data
+    # Streamed from the Polars frame, without a pandas copy
+    return write_excel(filtered_df)
+
+
+def download_buttons(dataset, query, df, file_name, formatted_excel=False):
+    """
+    Excel, CSV and Parquet downloads of the rows of a query in df. With formatted_excel, the
+    Excel file has the formatted market values of the table. Every file is only built when its
+    button is clicked, and kept in the result cache.
+    """
+
+    def excel_df():
+        return export_frame(get_display_df(dataset, query, df) if formatted_excel else df)
+
+    excel_part = "xlsx (formatted)" if formatted_excel else "xlsx"
+    excel_column, csv_column, parquet_column = st.columns(3)
+    with excel_column:
+        st.download_button(
+            label="Download til Excel",
+            data=deferred_export(
+                lambda: get_export(dataset, query, excel_part, to_excel_function, excel_df())
+            ),
+            file_name=f"{file_name}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+    with csv_column:
+        st.download_button(
+            label="Download som CSV",
+            data=deferred_export(
+                lambda: get_export(dataset, query, "csv", write_csv, export_frame(df))
+            ),
+            file_name=f"{file_name}.csv",
+            mime="text/csv",
+        )
+    with parquet_column:
+        st.download_button(
+            label="Download som Parquet",
+            data=deferred_export(
+                lambda: get_export(dataset, query, "parquet", write_parquet, export_frame(df))
+            ),
+            file_name=f"{file_name}.parquet",
+            mime="application/vnd.apache.parquet",
+        )
 
 
 # Function to load and inject CSS into the Streamlit app
@@ -339,29 +349,125 @@ def write_markdown_sidebar(how_we_did=False):
 
 
 def format_and_display_data(dataframe):
-    return dataframe.with_columns(
-        pl.col("Markedsværdi (DKK)")
-        .map_elements(format_number_european, return_dtype=pl.Utf8)
-        .alias("Markedsværdi (DKK)")
+    # Formatted in one vectorized expression, with the same output as format_number_european
+    return dataframe.with_columns(format_number_expr(pl.col("Markedsværdi (DKK)")))
+
+
+# The columns of the results table
+DISPLAY_COLUMNS = [
+    "OBS",
+    "Område",
+    "Værdipapirets navn",
+    "Markedsværdi (DKK)",
+    "Eksklusion (Af hvem og hvorfor)",
+    "Sortlistet",
+    "Problemkategori",
+    "Type",
+    "ISIN kode",
+    "Udsteder",
+]
+
+# The columns the pages use of the rows of a query: the table, the search and sort columns, the
+# organization links of 'Problematisk ifølge:', and 'Index' and 'Priority' for the downloads and
+# the key figures. Queries pushed down to SQLite only read these.
+QUERY_COLUMNS = list(
+    dict.fromkeys(["Index", *DISPLAY_COLUMNS, *SEARCH_COLUMNS, *SORT_COLUMNS, "Priority"])
+)
+
+# The text columns of the results table with few distinct values. They are sent to the browser
+# dictionary-encoded, so every distinct value is only sent once per page.
+CATEGORICAL_COLUMNS = [
+    "OBS",
+    "Område",
+    "Eksklusion (Af hvem og hvorfor)",
+    "Problemkategori",
+    "Type",
+    "Udsteder",
+]
+
+# Set LOG_TABLE_PAYLOADS=1 to log the size of every page of the results table sent to the browser
+LOG_TABLE_PAYLOADS = os.environ.get("LOG_TABLE_PAYLOADS") == "1"
+
+# The rows per page of the results table. Only the page shown is sent to the browser.
+PAGE_SIZES = [100, 500, 1000, 5000]
+
+# The presorted order of the dataset, with the most problematic investments first
+DEFAULT_ORDER = "Standard"
+
+
+def get_row_order(dataset, query, df, sort_by, descending):
+    """
+    The positions of the rows of a query sorted by a column, kept in the result cache. Ties
+    keep the presorted order.
+    """
+    return get_result_cache().get(
+        dataset,
+        query,
+        ("order", sort_by, descending),
+        lambda: df.select(
+            pl.arg_sort_by(sort_by, descending=descending, nulls_last=True, maintain_order=True)
+        ).to_series(),
     )
 
 
-def display_dataframe(df):
+def table_payload(page_df):
+    """
+    The page of the results table as it is sent to the browser: only the shown columns, the
+    repetitive texts as categoricals and the market value formatted the Danish way. Sorting by
+    market value uses the numbers, as the rows are ordered before the page is cut.
+    """
+    return page_df.select(DISPLAY_COLUMNS).with_columns(
+        pl.col(CATEGORICAL_COLUMNS).cast(pl.Categorical),
+        format_number_expr(pl.col("Markedsværdi (DKK)")),
+    )
+
+
+def log_table_payload(payload):
+    from streamlit.dataframe_util import convert_anything_to_arrow_bytes
+
+    size = len(convert_anything_to_arrow_bytes(payload))
+    log(f"Table payload: {payload.height} rows in {size / 1000:.1f} kB")
+
+
+def display_dataframe(dataset, query, df):
+    """
+    Show one page of the rows of a query. The rows are sorted and sliced on the server, and only
+    the rows of the page are sent to the browser.
+    """
+    sort_column, order_column, size_column, page_column = st.columns(4)
+    with sort_column:
+        sort_by = st.selectbox("Sortér efter:", [DEFAULT_ORDER] + DISPLAY_COLUMNS)
+    with order_column:
+        descending = (
+            st.selectbox("Rækkefølge:", ["Faldende", "Stigende"], disabled=sort_by == DEFAULT_ORDER)
+            == "Faldende"
+        )
+    with size_column:
+        page_size = st.selectbox("Rækker pr. side:", PAGE_SIZES)
+    pages = max(1, -(-df.height // page_size))
+    with page_column:
+        # A new widget when the number of pages changes, so the page is always in range
+        page = st.number_input(
+            f"Side (af {pages}):", min_value=1, max_value=pages, step=1, key=f"page-{pages}"
+        )
+
+    start = (page - 1) * page_size
+    if sort_by == DEFAULT_ORDER:
+        page_df = df.slice(start, page_size)
+    else:
+        page_df = df[get_row_order(dataset, query, df, sort_by, descending).slice(start, page_size)]
+
+    if df.height:
+        st.caption(
+            f"Viser række {format_number_european(start + 1)}-"
+            f"{format_number_european(start + page_df.height)} af "
+            f"{format_number_european(df.height)}."
+        )
+    payload = table_payload(page_df)
+    if LOG_TABLE_PAYLOADS:
+        log_table_payload(payload)
     st.dataframe(
-        df[
-            [
-                "OBS",
-                "Område",
-                "Værdipapirets navn",
-                "Markedsværdi (DKK)",
-                "Eksklusion (Af hvem og hvorfor)",
-                "Sortlistet",
-                "Problemkategori",
-                "Type",
-                "ISIN kode",
-                "Udsteder",
-            ]
-        ],
+        payload,
         column_config={
             "OBS": st.column_config.TextColumn(),
             "Område": "Område",
@@ -0,0 +1,153 @@
+from functools import lru_cache
+
+import polars as pl
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from utils.log import log
+
+DATABASE_PATH = "data/investerings_database.db"
+
+# Output column -> SQL expression in kommunale_regioner_investeringer
+INVESTMENT_COLUMNS = {
+    # The rowid is the stable id of a row, the same in every session and export
+    "Index": "[rowid]",
+    "Område": "[Kommune]",
+    "ISIN kode": "[ISIN kode]",
+    "Værdipapirets navn": "[Værdipapirets navn]",
+    "Udsteder": "[Udsteder]",
+    "Markedsværdi (DKK)": "[Markedsværdi (DKK)]",
+    "Type": "[Type]",
+    "Problematisk ifølge:": "[Problematisk ifølge:]",
+    "Eksklusion (Af hvem og hvorfor)": "[Årsag til eksklusion]",
+    "Sortlistet": "[Sortlistet]",
+    "Problemkategori": "[Problemkategori]",
+    "Priority": "[Priority]",
+    "OBS": """CASE
+        WHEN [OBS_Type] = 'red' THEN '🟥(1)'
+        WHEN [OBS_Type] = 'orange' THEN '🟧(2)'
+        WHEN [OBS_Type] = 'yellow' THEN '🟨(3)'
+        ELSE ''
+    END""",
+}
+
+# The columns the single-area queries filter on
+INVESTMENT_INDEXES = {
+    "idx_investeringer_kommune": "[Kommune]",
+    "idx_investeringer_priority": "[Priority]",
+    "idx_investeringer_isin": "[ISIN kode]",
+}
+
+AI_TEXTS_QUERY = text("SELECT [Kommune], [Resumé] FROM kommunale_regioner_ai_tekster")
+
+AREAS_QUERY = text("SELECT DISTINCT [Kommune] FROM kommunale_regioner_investeringer")
+
+
+def select_investments_sql(columns=None):
+    # Always in the order of INVESTMENT_COLUMNS, so a projection has the columns of the snapshot
+    select_list = ", ".join(
+        f"{expression} AS [{column}]"
+        for column, expression in INVESTMENT_COLUMNS.items()
+        if columns is None or column in columns
+    )
+    return f"SELECT {select_list} FROM kommunale_regioner_investeringer"
+
+
+INVESTMENTS_QUERY = text(select_investments_sql())
+
+
+# One pooled engine for the whole process, shared by every query in the app
+@lru_cache(maxsize=None)
+def get_engine():
+    return create_engine(f"sqlite:///{DATABASE_PATH}")
+
+
+def ensure_indexes():
+    """
+    Create the indexes used by the single-area queries, if they do not exist yet.
+    """
+    try:
+        with get_engine().begin() as conn:
+            for name, column in INVESTMENT_INDEXES.items():
+                conn.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS {name} "
+                        f"ON kommunale_regioner_investeringer ({column})"
+                    )
+                )
+    except OperationalError as e:
+        # A read-only database can still be queried, just without the indexes
+        log(f"Could not create indexes in {DATABASE_PATH}: {e}")
+
+
+def read_investments():
+    # Execute the query and load the result into a Polars DataFrame
+    with get_engine().connect() as conn:
+        return pl.read_database(INVESTMENTS_QUERY, conn)
+
+
+def query_investments(areas=None, priorities=None, isins=None, columns=None):
+    """
+    Read only the matching rows and columns, with the filtering done by SQLite.
+    'priorities' may contain None to include rows without a priority.
+    """
+    conditions = []
+    params = {}
+
+    if areas is not None:
+        conditions.append("[Kommune] IN :areas")
+        params["areas"] = list(areas)
+
+    if priorities is not None:
+        values = [p for p in priorities if p is not None]
+        priority_conditions = ["[Priority] IN :priorities"]
+        if None in priorities:
+            priority_conditions.append("[Priority] IS NULL")
+        conditions.append(f"({' OR '.join(priority_conditions)})")
+        params["priorities"] = values
+
+    if isins is not None:
+        conditions.append("[ISIN kode] IN :isins")
+        params["isins"] = list(isins)
+
+    sql = select_investments_sql(columns)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+
+    query = text(sql).bindparams(*(bindparam(name, expanding=True) for name in params))
+
+    with get_engine().connect() as conn:
+        return pl.read_database(
+            query,
+            conn,
+            execute_options={"parameters": params},
+            # Small results can be all-null in a column, so infer from every row
+            infer_schema_length=None,
+        )
+
+
+def read_areas():
+    with get_engine().connect() as conn:
+        return [area for (area,) in conn.execute(AREAS_QUERY)]
+
+
+def read_distinct_values(column):
+    """
+    Read the distinct non-null values of an output column, e.g. the "; "-joined 'Problemkategori'.
+    """
+    expression = INVESTMENT_COLUMNS[column]
+    query = text(
+        f"SELECT DISTINCT {expression} FROM kommunale_regioner_investeringer "
+        f"WHERE {expression} IS NOT NULL"
+    )
+    with get_engine().connect() as conn:
+        return [value for (value,) in conn.execute(query)]
+
+
+def read_ai_texts():
+    """
+    Load every AI summary at once, as a mapping from area to 'Resumé'.
+    """
+    with get_engine().connect() as conn:
+        rows = conn.execute(AI_TEXTS_QUERY).all()
+    return {area: summary for area, summary in rows}
@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+
+import polars as pl
+import streamlit as st
+
+from utils.bitmask import BITMASK_COLUMNS, bit_values, distinct_values, encode_bitmasks
+from utils.database import (
+    DATABASE_PATH,
+    ensure_indexes,
+    get_engine,
+    query_investments,
+    read_areas,
+    read_distinct_values,
+)
+from utils.log import log
+from utils.schema import SORT_COLUMNS, apply_schema, encode_areas, presort
+from utils.snapshot import (
+    SNAPSHOT_PATH,
+    build_snapshot,
+    read_database,
+    read_snapshot,
+    snapshot_is_fresh,
+)
+
+# How many results of queries are kept per cached function
+QUERY_CACHE_ENTRIES = 100
+
+# How often (in seconds) the watcher checks the database and snapshot for a new version
+RELOAD_CHECK_INTERVAL = 30
+
+# With DATA_QUERY_MODE=sqlite, views of single areas are queried from SQLite, and the national
+# table is only materialized the first time a view needs all of it (e.g. "Hele landet")
+LAZY_QUERIES = os.environ.get("DATA_QUERY_MODE", "memory") == "sqlite"
+
+
+class Dataset:
+    """
+    One immutable version of the investment data.
+    """
+
+    def __init__(self, version, df=None):
+        self.version = version
+        self._df = df
+        self._areas = None
+        self._bit_values = None
+        self._lock = threading.Lock()
+
+    @property
+    def df(self):
+        if self._df is None:
+            with self._lock:
+                if self._df is None:
+                    self._df = read_snapshot() if snapshot_is_fresh() else read_database()
+        return self._df
+
+    @property
+    def areas(self):
+        """
+        The sorted names of the areas, the categories of the 'Område' Enum.
+        """
+        if self._areas is None:
+            if self._df is None:
+                # Without the national table, the areas are read from SQLite
+                self._areas = sorted(read_areas())
+            else:
+                self._areas = self._df["Område"].cat.get_categories().to_list()
+        return self._areas
+
+    @property
+    def bit_values(self):
+        """
+        The values of the multi-valued columns, in the order of their bits.
+        """
+        if self._bit_values is None:
+            if self._df is None:
+                # Without the national table, the values are read from SQLite
+                self._bit_values = {
+                    column: distinct_values(
+                        pl.Series(column, read_distinct_values(column), dtype=pl.Utf8)
+                    )
+                    for column in BITMASK_COLUMNS
+                }
+            else:
+                self._bit_values = bit_values(self._df)
+        return self._bit_values
+
+    def query(self, areas=None, priorities=None, isins=None, columns=None):
+        """
+        Read only the matching rows from SQLite, without materializing the national table.
+        """
+        df = apply_schema(
+            query_investments(areas, priorities, isins, columns), require_all=columns is None
+        )
+        # Sorting the few rows of a single area is cheap, and gives the same order as the snapshot
+        if all(column in df.columns for column in SORT_COLUMNS):
+            df = presort(df)
+        if "Område" in df.columns:
+            df = encode_areas(df, self.areas)
+        return encode_bitmasks(df, self.bit_values)
+
+
+# Cached functions that take a Dataset are keyed by its version instead of hashing the frame
+HASH_BY_VERSION = {Dataset: lambda dataset: dataset.version}
+
+
+def derived_cache(func):
+    """
+    Cache a function of the dataset per version. Only the current and the previous version
+    are kept, so runs still holding the previous version are served while a new one is
+    swapped in, and older versions are evicted.
+    """
+    return st.cache_resource(hash_funcs=HASH_BY_VERSION, max_entries=2)(func)
+
+
+def query_cache(func):
+    """
+    Cache a function of the dataset and a query (an InvestmentQuery, which is immutable) per
+    version and query, shared by every session.
+    """
+    return st.cache_resource(
+        hash_funcs=HASH_BY_VERSION, max_entries=QUERY_CACHE_ENTRIES, show_spinner=False
+    )(func)
+
+
+def source_fingerprint():
+    """
+    Identify the current version of the data files by their modification time and size.
+    """
+    parts = []
+    for path in (DATABASE_PATH, SNAPSHOT_PATH):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_mtime_ns}-{stat.st_size}")
+        except FileNotFoundError:
+            parts.append("missing")
+    return ":".join(parts)
+
+
+def load_dataset():
+    if LAZY_QUERIES:
+        # The indexes of the area queries. Before the snapshot is checked, as creating them
+        # changes the database file.
+        ensure_indexes()
+        # Make sure the national table can later be memory-mapped from a fresh snapshot
+        if not snapshot_is_fresh():
+            build_snapshot()
+        return Dataset(version=source_fingerprint())
+
+    # Read the prebuilt columnar snapshot, and only go through SQLite when it is missing or stale
+    df = read_snapshot() if snapshot_is_fresh() else build_snapshot()
+
+    # Fingerprint after loading, so a snapshot written by build_snapshot is part of the version
+    return Dataset(version=source_fingerprint(), df=df)
+
+
+class DatasetStore:
+    """
+    Holds the current dataset and swaps in a new one when the data files change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = load_dataset()
+        threading.Thread(target=self._watch, name="dataset-watcher", daemon=True).start()
+
+    @property
+    def current(self):
+        return self._current
+
+    def _watch(self):
+        while True:
+            time.sleep(RELOAD_CHECK_INTERVAL)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                # Keep serving the current version if the new one cannot be loaded
+                log(f"Dataset reload failed: {e}")
+
+    def reload_if_changed(self):
+        # Imported here, as the warm-up builds on modules that depend on this one
+        from utils.warmup import warm_up
+
+        with self._lock:
+            if source_fingerprint() == self._current.version:
+                return False
+
+            started = time.perf_counter()
+            # The pooled connections still have the replaced database file open
+            get_engine().dispose()
+            dataset = load_dataset()
+
+            # Precompute the new version's caches before anyone can be served from it
+            warm_up(dataset)
+
+            # Replacing the reference is atomic; runs that already hold the old dataset keep it
+            self._current = dataset
+
+        log(f"Dataset reloaded in {time.perf_counter() - started:.2f}s (version {dataset.version})")
+        return True
+
+
+# Cached as a resource: every session and rerun shares the same frame instead of receiving
+# its own unpickled copy. Polars operations never modify a frame in place, so sharing it is
+# thread-safe as long as no caller uses the in-place methods (insert_column, extend, ...).
+@st.cache_resource(show_spinner="Indlæser data")
+def get_dataset_store():
+    return DatasetStore()
+
+
+def get_dataset():
+    """
+    Return the current dataset. Fetch it once per script run and use it throughout the run,
+    so a reload in the middle of a run cannot mix two versions.
+    """
+    return get_dataset_store().current
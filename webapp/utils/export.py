@@ -0,0 +1,141 @@
+import threading
+import time
+from io import BytesIO
+
+import polars.selectors as cs
+import xlsxwriter
+
+from utils.log import log
+
+# The rows of an Excel sheet, including the header row. Larger exports continue on a new sheet.
+EXCEL_MAX_ROWS = 1_048_576
+
+# The rows converted to Python values at a time, so a large frame is never copied at once
+EXPORT_BATCH_ROWS = 10_000
+
+# The CSV dialect of Danish spreadsheets: ";" between the fields and "," before the decimals.
+# The byte order mark makes Excel read the file as UTF-8.
+CSV_OPTIONS = {"separator": ";", "decimal_comma": True, "include_bom": True}
+
+# Log the export counters every this many downloads offered
+LOG_EVERY_OFFERS = 100
+
+# The header format of pandas' to_excel, so the workbooks look as they did
+HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+
+def sheet_slices(df, max_rows=EXCEL_MAX_ROWS):
+    """
+    The slices of the frame that fit on a sheet below the header row.
+    """
+    rows_per_sheet = max_rows - 1
+    for offset in range(0, max(df.height, 1), rows_per_sheet):
+        yield df.slice(offset, rows_per_sheet)
+
+
+def write_excel(df, max_rows=EXCEL_MAX_ROWS):
+    """
+    An Excel workbook of a Polars frame, as bytes. The rows are streamed into xlsxwriter in its
+    constant memory mode, which writes every row to disk as soon as the next one starts, so
+    neither the workbook nor a pandas copy of the frame is held in memory while it is written.
+    """
+    start = time.perf_counter()
+    # pandas wrote NaN as an empty cell, which xlsxwriter only does for nulls
+    df = df.with_columns(cs.float().fill_nan(None))
+    output = BytesIO()
+    sheets = 0
+    with xlsxwriter.Workbook(output, {"constant_memory": True}) as workbook:
+        header_format = workbook.add_format(HEADER_FORMAT)
+        for sheet_df in sheet_slices(df, max_rows):
+            sheets += 1
+            worksheet = workbook.add_worksheet(f"Sheet{sheets}")
+            worksheet.write_row(0, 0, sheet_df.columns, header_format)
+
+            row = 1
+            for batch in sheet_df.iter_slices(EXPORT_BATCH_ROWS):
+                for values in batch.iter_rows():
+                    worksheet.write_row(row, 0, values)
+                    row += 1
+
+    data = output.getvalue()
+    log_export("Excel", df, data, start, f" on {sheets} sheet(s)")
+    return data
+
+
+def write_csv(df):
+    """
+    A CSV file of a Polars frame, as bytes, written by Polars in batches.
+    """
+    start = time.perf_counter()
+    output = BytesIO()
+    df.write_csv(output, **CSV_OPTIONS)
+    data = output.getvalue()
+    log_export("CSV", df, data, start)
+    return data
+
+
+def write_parquet(df):
+    """
+    A Parquet file of a Polars frame, as bytes, which keeps the dtypes of the columns.
+    """
+    start = time.perf_counter()
+    output = BytesIO()
+    df.write_parquet(output)
+    data = output.getvalue()
+    log_export("Parquet", df, data, start)
+    return data
+
+
+def log_export(kind, df, data, start, details=""):
+    log(
+        f"{kind} export: {df.height} rows{details}, {len(data) / 1e6:.1f} MB "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+class ExportCounter:
+    """
+    The downloads the pages offered and the files built for them. A file is only built when its
+    download button is clicked, so every other offer is a file that was never built.
+    """
+
+    def __init__(self):
+        self.offered = 0
+        self.built = 0
+        self._lock = threading.Lock()
+
+    def offer(self):
+        with self._lock:
+            self.offered += 1
+            offered = self.offered
+        if offered % LOG_EVERY_OFFERS == 0:
+            self.log()
+
+    def build(self):
+        with self._lock:
+            self.built += 1
+        self.log()
+
+    def log(self):
+        log(
+            f"Exports: {self.built} built of {self.offered} offered, "
+            f"{self.offered - self.built} not built"
+        )
+
+
+EXPORT_COUNTER = ExportCounter()
+
+
+def deferred_export(build):
+    """
+    The data of a download button as a callable, so Streamlit only builds the file when the
+    button is clicked instead of on every rerun of the page.
+    """
+    EXPORT_COUNTER.offer()
+
+    def build_on_click():
+        data = build()
+        EXPORT_COUNTER.build()
+        return data
+
+    return build_on_click
@@ -0,0 +1,115 @@
+import polars as pl
+
+# The number format of format_number_european, which is babel's da_DK pattern "#,##0.###": "."
+# between the thousands, "," before the decimals, at most 3 decimals without trailing zeros, and
+# "-" before negative numbers (also numbers that round to zero)
+MAX_DIGITS = 3
+
+# Veltkamp's constant, which splits a float into two halves whose products with a power of ten
+# up to 10**MAX_DIGITS are exact
+SPLITTER = 2.0**27 + 1
+
+# Enough groups of thousands for every integer below 2**53
+GROUPS = 6
+
+
+def scaled_round_expr(value, digits):
+    """
+    The value rounded to the digits, as the integer round(value * 10**digits), with ties to even
+    on the exact value like Python's round(value, digits). The product is rounded as a float, so
+    its rounding error is computed exactly to settle the ties it creates or hides.
+    """
+    scale = 10**digits
+    product = value * scale
+    split = value * SPLITTER
+    high = split - (split - value)
+    low = value - high
+    error = (high * scale - product) + low * scale
+
+    rounded = product.round(0, mode="half_to_even")
+    half = product - rounded
+    return (
+        pl.when((half == 0.5) & (error > 0))
+        .then(rounded + 1)
+        .when((half == -0.5) & (error < 0))
+        .then(rounded - 1)
+        .otherwise(rounded)
+        .cast(pl.Int64, strict=False)
+    )
+
+
+def group_thousands_expr(integer):
+    """
+    A non-negative integer with a "." between the thousands. The groups are computed as numbers
+    and padded with zeros, which is much faster than inserting the separators with a regex.
+    """
+    groups = [
+        ((integer // 1000**k) % 1000 + 1000).cast(pl.Utf8).str.slice(1)
+        for k in range(GROUPS - 1, -1, -1)
+    ]
+    grouped = pl.concat_str(groups, separator=".").str.strip_chars_start("0.")
+    return pl.when(integer < 1000).then(integer.cast(pl.Utf8)).otherwise(grouped)
+
+
+def format_number_expr(expr, digits=0):
+    """
+    format_number_european as a Polars expression, with the same output for every value below
+    2**52 / 10**digits. Above that, floats are further apart than the digits, and babel prints
+    the shortest digits of the float instead. Nulls stay null, and the column keeps its name.
+    """
+    if not 0 <= digits <= MAX_DIGITS:
+        raise ValueError(f"digits must be between 0 and {MAX_DIGITS}, not {digits}")
+
+    value = expr.cast(pl.Float64)
+    scaled = scaled_round_expr(value, digits).abs()
+    scale = 10**digits
+
+    # Rounding keeps the sign, so -0.3 is "-0" like in babel
+    negative = (value < 0) | ((value == 0) & (1 / value < 0))
+    sign = pl.when(negative).then(pl.lit("-")).otherwise(pl.lit(""))
+    integer = group_thousands_expr(scaled // scale)
+    if digits:
+        fraction = (scaled % scale).cast(pl.Utf8).str.zfill(digits).str.strip_chars_end("0")
+        number = pl.concat_str(
+            integer, pl.when(fraction != "").then(pl.lit(",") + fraction).otherwise(pl.lit(""))
+        )
+    else:
+        number = integer
+
+    return (
+        pl.when(value.is_nan())
+        .then(pl.lit("NaN"))
+        .when(value.is_infinite())
+        .then(sign + pl.lit("∞"))
+        .otherwise(sign + number)
+        .name.keep()
+    )
+
+
+def divide_expr(expr, divisor):
+    """
+    expr / divisor as a float, rounded like Python's division. Polars divides by a scalar through
+    its reciprocal, which can be one unit in the last place off, so the divisor is made a column.
+    """
+    value = expr.cast(pl.Float64)
+    return value / (value * 0 + divisor)
+
+
+def million_or_billion_expr(expr, digits=2):
+    """
+    round_to_million_or_billion as a Polars expression: "(x mia.)" from a billion, "(x mio.)"
+    from a million and otherwise "". Nulls stay null, and the column keeps its name.
+    """
+    # Truncated towards zero like int(value)
+    value = expr.cast(pl.Int64, strict=False)
+    size = value.abs()
+    return (
+        pl.when(value.is_null())
+        .then(pl.lit(None, dtype=pl.Utf8))
+        .when(size >= 10**9)
+        .then(pl.format("({} mia.)", format_number_expr(divide_expr(value, 10**9), digits)))
+        .when(size >= 10**6)
+        .then(pl.format("({} mio.)", format_number_expr(divide_expr(value, 10**6), digits)))
+        .otherwise(pl.lit(""))
+        .name.keep()
+    )
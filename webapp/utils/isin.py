@@ -0,0 +1,80 @@
+import re
+
+import numpy as np
+import polars as pl
+
+from utils.dataset import derived_cache
+
+# An ISIN: a country code, nine letters or digits and a check digit
+ISIN_PATTERN = re.compile(r"[A-Z]{2}[A-Z0-9]{9}[0-9]")
+
+
+def isin_checksum_ok(isin):
+    """
+    Whether the check digit of the ISIN is right: the Luhn checksum of the ISIN, with every
+    letter replaced by its number (A=10, ..., Z=35).
+    """
+    digits = "".join(str(int(char, 36)) for char in isin)
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        n = int(digit) * (2 if i % 2 else 1)
+        total += n - 9 if n > 9 else n
+    return total % 10 == 0
+
+
+def parse_isin(text):
+    """
+    The ISIN in the text if the text is a single valid ISIN, otherwise None.
+    """
+    isin = text.strip().upper()
+    if ISIN_PATTERN.fullmatch(isin) and isin_checksum_ok(isin):
+        return isin
+    return None
+
+
+def find_isins(text):
+    """
+    The valid and the invalid ISINs in a pasted or uploaded text, in the order they appear and
+    without duplicates. ISINs may be separated by anything but letters and digits.
+    """
+    valid, invalid = {}, {}
+    for word in re.findall(r"[A-Za-z0-9]+", text):
+        isin = word.upper()
+        if ISIN_PATTERN.fullmatch(isin):
+            (valid if isin_checksum_ok(isin) else invalid)[isin] = None
+    return list(valid), list(invalid)
+
+
+class IsinIndex:
+    """
+    The positions of the rows of every 'ISIN kode' in the dataset, so looking up ISINs never
+    scans the table.
+    """
+
+    def __init__(self, df):
+        self.height = df.height
+        groups = (
+            df.select(pl.col("ISIN kode").str.to_uppercase())
+            .with_row_index("Row")
+            .drop_nulls("ISIN kode")
+            .group_by("ISIN kode")
+            .agg(pl.col("Row"))
+        )
+        self.rows_by_isin = {
+            isin: rows.to_numpy() for isin, rows in zip(groups["ISIN kode"], groups["Row"])
+        }
+
+    def mask(self, isins):
+        """
+        A boolean mask of the rows of the ISINs, in one batched lookup.
+        """
+        mask = np.zeros(self.height, dtype=bool)
+        rows = [self.rows_by_isin[isin] for isin in isins if isin in self.rows_by_isin]
+        if rows:
+            mask[np.concatenate(rows)] = True
+        return mask
+
+
+@derived_cache
+def get_isin_index(dataset):
+    return IsinIndex(dataset.df)
@@ -1,30 +1,33 @@
 import polars as pl
 import plotly.express as px
-import streamlit as st
-from utils.data_processing import format_number_european, round_to_million_or_billion
+from utils.dataset import query_cache
+from utils.formatting import format_number_expr, million_or_billion_expr
 
 
-def create_pie_chart(filtered_df):
-    # Group the data by 'Type' and sum the 'Markedsværdi (DKK)'
-    type_distribution = (
-        filtered_df.group_by("Type")
-        .agg(pl.col("Markedsværdi (DKK)").sum().alias("Total Markedsværdi"))
-        .to_pandas()
-    )  # Convert to pandas for plotting
+# The figure is cached per filter state, so reruns from unrelated widgets reuse it
+@query_cache
+def get_pie_chart(dataset, query, _cells):
+    return build_pie_chart(_cells)
 
-    # Drop rows with missing values (NaN) in 'Total Markedsværdi' or 'Type'
-    type_distribution = type_distribution.dropna(subset=["Total Markedsværdi", "Type"])
 
-    # Combine 'Andet' and 'Ikke angivet' into one category
-    type_distribution["Type"] = type_distribution["Type"].replace(
-        {"Andet": "Andet/ikke angivet", "Ikke angivet": "Andet/ikke angivet"}
+def build_pie_chart(cells):
+    """
+    The pie chart of 'Markedsværdi (DKK)' by 'Type', from rows or aggregated cells.
+    """
+    type_distribution = (
+        cells.filter(pl.col("Type").is_not_null())
+        # Combine 'Andet' and 'Ikke angivet' into one category
+        .with_columns(
+            pl.col("Type").replace(
+                {"Andet": "Andet/ikke angivet", "Ikke angivet": "Andet/ikke angivet"}
+            )
+        )
+        # Group the data by 'Type' and sum the 'Markedsværdi (DKK)'
+        .group_by("Type")
+        .agg(pl.col("Markedsværdi (DKK)").sum().alias("Total Markedsværdi"))
+        .sort("Type")
     )
 
-    # Re-aggregate the data to group by the combined category, summing only the numeric column
-    type_distribution = type_distribution.groupby("Type", as_index=False)[
-        "Total Markedsværdi"
-    ].sum()
-
     # Define a color mapping for consistent colors
     color_mapping = {
         "Aktie": "cornflowerblue",
@@ -33,35 +36,20 @@ def create_pie_chart(filtered_df):
         "Andet/Ikke angivet": "lightgray",
     }
 
-    # Match the colors with the values in 'Type'
-    type_distribution["color"] = type_distribution["Type"].map(color_mapping)
-
-    # Apply rounding to 'Total Markedsværdi' for display in hover text
-    type_distribution["Markedsværdi_display"] = type_distribution["Total Markedsværdi"].apply(
-        lambda x: format_number_european(x, 0)  # Format with European conventions
-    )
-
-    # Apply rounding to 'Total Markedsværdi' for display in hover text
-    type_distribution["Markedsværdi_display_mio_mia"] = type_distribution[
-        "Total Markedsværdi"
-    ].apply(
-        lambda x: round_to_million_or_billion(x, 1)  # Format with European conventions
-    )
-
-    total_value = type_distribution["Total Markedsværdi"].sum()
-    type_distribution["Percent"] = type_distribution["Total Markedsværdi"].apply(
-        lambda x: f"{format_number_european((x / total_value) * 100, 2)} %"
-    )
-
-    # Combine Markedsværdi_display and Percent into one hover text string
-    type_distribution["Hover_text"] = type_distribution.apply(
-        lambda row: f"{row['Markedsværdi_display']} {row['Markedsværdi_display_mio_mia']} ({row['Percent']})",
-        axis=1,
+    # The hover text: the value, the value in mio./mia. and the share, e.g. "1.234.567 (1,2 mio.) (12,5 %)"
+    total = pl.col("Total Markedsværdi")
+    type_distribution = type_distribution.with_columns(
+        pl.format(
+            "{} {} ({} %)",
+            format_number_expr(total, 0),
+            million_or_billion_expr(total, 1),
+            format_number_expr(total / total.sum() * 100, 2),
+        ).alias("Hover_text")
     )
 
     # Create a pie chart using Plotly
     fig = px.pie(
-        type_distribution,
+        type_distribution.to_dict(as_series=False),
         values="Total Markedsværdi",
         names="Type",
         color="Type",  # Set colors for categories
@@ -73,7 +61,7 @@ def create_pie_chart(filtered_df):
         textinfo="percent",  # Show only percentage
         texttemplate="%{percent:.0%}",  # Rounded percentage, no decimals
         hovertemplate="<b>%{label}</b><br>Markedsværdi DKK (andel): %{customdata[0]}<br>",
-        customdata=type_distribution[["Hover_text"]].to_numpy(),
+        customdata=type_distribution.select("Hover_text").to_numpy(),
         sort=False,  # Keeps the original order of the data
         rotation=90,
     )
@@ -96,4 +84,4 @@ def create_pie_chart(filtered_df):
     )
     # fig.layout.yaxis.tickformat = ',.0%'
 
-    st.plotly_chart(fig)
+    return fig
@@ -0,0 +1,308 @@
+import os
+import re
+from dataclasses import dataclass
+
+import numpy as np
+import polars as pl
+
+from utils.bitmask import BITMASK_COLUMNS, all_of_expr, any_of_expr
+from utils.isin import parse_isin
+
+# Custom choices in the area dropdown
+ALL_VALUES = "Hele landet"
+MUNICIPALITIES = "Alle kommuner"
+REGIONS = "Alle regioner"
+
+# The areas in REGIONS. Every other area is a kommune.
+REGION_AREAS = [
+    "Region Hovedstaden",
+    "Region Midtjylland",
+    "Region Nordjylland",
+    "Region Sjælland",
+    "Region Syddanmark",
+]
+
+# The columns the free-text search looks in
+SEARCH_COLUMNS = [
+    "Værdipapirets navn",
+    "Udsteder",
+    "ISIN kode",
+    "Problematisk ifølge:",
+    "Eksklusion (Af hvem og hvorfor)",
+    "Problemkategori",
+    "Type",
+    "Område",
+]
+
+# The similarity of each row to a typo-tolerant search, used to rank the results
+SCORE_COLUMN = "Søgescore"
+
+# Set LOG_QUERY_PLANS=1 to log the optimized plan of every query the pages run
+LOG_QUERY_PLANS = os.environ.get("LOG_QUERY_PLANS") == "1"
+
+
+def normalize_text(text):
+    # Replace special characters with a single space, collapse multiple spaces, and normalize to lowercase
+    text = re.sub(r"[^\w\s]", " ", text).lower()  # Replace non-alphanumeric characters with space
+    text = re.sub(r"\s+", " ", text).strip()  # Collapse multiple spaces into one and trim
+    return text
+
+
+def normalize_expr(expr):
+    # The same normalization as normalize_text, as a Polars expression
+    return (
+        expr.str.replace_all(r"[^\w\s]", " ")  # Replace non-alphanumeric chars with space
+        .str.to_lowercase()  # Convert to lowercase
+        .str.replace_all(r"\s+", " ")  # Collapse multiple spaces
+        .str.strip_chars()  # Trim leading and trailing spaces
+    )
+
+
+def choice_expr(choice):
+    """
+    Predicate for a single selection (ALL_VALUES, MUNICIPALITIES, REGIONS, or a specific kommune).
+    """
+    # Compared as strings, as an Enum column cannot be compared to names outside the Enum
+    area = pl.col("Område").cast(pl.Utf8)
+    if choice == ALL_VALUES:
+        return None
+    elif choice == MUNICIPALITIES:
+        return ~area.is_in(REGION_AREAS)
+    elif choice == REGIONS:
+        return area.is_in(REGION_AREAS)
+    else:
+        return area == choice
+
+
+def areas_expr(areas):
+    """
+    Predicate for multiple selected areas, ignoring the custom choices.
+    """
+    specific_kommuner = [
+        area for area in areas if area not in [ALL_VALUES, MUNICIPALITIES, REGIONS]
+    ]
+    if not specific_kommuner:
+        return None
+    return pl.col("Område").cast(pl.Utf8).is_in(specific_kommuner)
+
+
+def priorities_expr(priorities):
+    """
+    Predicate for the selected priorities, where None selects rows without a priority.
+    """
+    values = [p for p in priorities if p is not None]
+    if None in priorities:
+        return pl.col("Priority").is_in(values) | pl.col("Priority").is_null()
+    return pl.col("Priority").is_in(values)
+
+
+def categories_expr(categories, values=None, all_of=False):
+    """
+    Predicate for rows where any (or with all_of, all) of the selected categories are in
+    'Problemkategori'. With the category values of the dataset, the predicate runs on the
+    bitmask column, and otherwise on the strings.
+    """
+    if not categories:
+        return None
+    if values is not None:
+        if all_of:
+            return all_of_expr("Problemkategori", values, categories)
+        return any_of_expr("Problemkategori", values, categories)
+
+    combine = pl.all_horizontal if all_of else pl.any_horizontal
+    return combine(
+        pl.col("Problemkategori").str.contains(category, literal=True) for category in categories
+    )
+
+
+def isins_expr(isins):
+    """
+    Predicate for the rows of a list of ISINs.
+    """
+    if not isins:
+        return None
+    return pl.col("ISIN kode").str.to_uppercase().is_in(list(isins))
+
+
+def search_expr(columns, search_query):
+    """
+    Predicate for rows where any column contains the normalized search query. The columns are
+    only cast to strings inside the predicate, so the result keeps its dtypes.
+    """
+    if not search_query:
+        return None
+
+    normalized_search_query = normalize_text(search_query)
+    return pl.any_horizontal(
+        normalize_expr(pl.col(column).cast(pl.Utf8).fill_null("")).str.contains(
+            normalized_search_query, literal=True
+        )
+        for column in columns
+    )
+
+
+@dataclass(frozen=True)
+class QueryIndexes:
+    """
+    The indexes of a dataset that a query can use: the SearchIndex, the bit values of the
+    bitmask columns, the AreaIndex and the IsinIndex. Without an index, the query scans the
+    columns instead.
+    """
+
+    search: object = None
+    bit_values: dict = None
+    areas: object = None
+    isins: object = None
+
+
+@dataclass(frozen=True)
+class InvestmentQuery:
+    """
+    Every selection on a page, compiled into a single lazy query plan so Polars can combine
+    the predicates. The dataset is presorted, and filtering keeps that order.
+    """
+
+    choice: str = ALL_VALUES
+    areas: tuple = ()
+    priorities: tuple = None
+    categories: tuple = ()
+    all_categories: bool = False
+    search_query: str = ""
+    fuzzy: bool = False
+    isins: tuple = ()
+
+    def canonical(self):
+        """
+        The equivalent query in a canonical form, so selections that filter the same rows in the
+        same order are equal: a single area is selected through areas, the selections are
+        sorted, and the search query is normalized.
+        """
+        choice, areas = self.choice, sorted(
+            area for area in self.areas if area not in [ALL_VALUES, MUNICIPALITIES, REGIONS]
+        )
+        if choice not in [ALL_VALUES, MUNICIPALITIES, REGIONS] and not areas:
+            choice, areas = ALL_VALUES, [choice]
+
+        priorities = self.priorities
+        if priorities is not None:
+            priorities = sorted(set(priorities), key=lambda p: (p is None, p))
+
+        categories = sorted(set(self.categories))
+        search_query = normalize_text(self.search_query)
+        return InvestmentQuery(
+            choice=choice,
+            areas=tuple(areas),
+            priorities=tuple(priorities) if priorities is not None else None,
+            categories=tuple(categories),
+            all_categories=self.all_categories and len(categories) > 1,
+            search_query=search_query,
+            fuzzy=self.fuzzy and bool(search_query),
+            isins=tuple(sorted(set(isin.upper() for isin in self.isins))),
+        )
+
+    def pushdown_areas(self, all_areas):
+        """
+        The areas selected, for queries that filter in SQLite. "Alle kommuner" and "Alle
+        regioner" are expanded to their areas among all_areas, and only "Hele landet" without
+        specific areas selects every area (None).
+        """
+        if self.areas:
+            return list(self.areas)
+        if self.choice == MUNICIPALITIES:
+            return [area for area in all_areas if area not in REGION_AREAS]
+        if self.choice == REGIONS:
+            return [area for area in all_areas if area in REGION_AREAS]
+        if self.choice != ALL_VALUES:
+            return [self.choice]
+        return None
+
+    def predicates(self, columns, indexes, search_mask=None):
+        """
+        The predicates of the selections. The areas are not filtered here when the area index
+        selects them, and the search is the search_mask from the search index when given,
+        otherwise a scan of the searchable columns. A typo-tolerant search is a filter on
+        SCORE_COLUMN instead, which plan adds. The categories are filtered on their bitmask
+        when the frame has it and the bit values of the dataset are given. The ISINs are part
+        of the search_mask when the ISIN index is given.
+        """
+        category_values = None
+        if indexes.bit_values is not None and BITMASK_COLUMNS["Problemkategori"] in columns:
+            category_values = indexes.bit_values["Problemkategori"]
+
+        if search_mask is not None:
+            search_predicate = pl.lit(pl.Series("Search", search_mask))
+        elif self.fuzzy and indexes.search is not None:
+            search_predicate = None
+        else:
+            search_predicate = search_expr(
+                [column for column in SEARCH_COLUMNS if column in columns], self.search_query
+            )
+
+        predicates = [
+            choice_expr(self.choice) if indexes.areas is None else None,
+            areas_expr(self.areas) if indexes.areas is None else None,
+            priorities_expr(self.priorities) if self.priorities is not None else None,
+            categories_expr(self.categories, category_values, self.all_categories),
+            search_predicate,
+            isins_expr(self.isins) if indexes.isins is None else None,
+        ]
+        return [predicate for predicate in predicates if predicate is not None]
+
+    def plan(self, df, indexes=None):
+        """
+        The lazy query plan on df. The indexes must have been built from df itself.
+        """
+        indexes = indexes or QueryIndexes()
+
+        search_mask = scores = None
+        isin = parse_isin(self.search_query) if indexes.isins is not None else None
+        if isin is not None:
+            # A single ISIN is looked up instead of searched for. It only matches 'ISIN kode'.
+            search_mask = indexes.isins.mask([isin])
+        elif self.search_query and indexes.search is not None:
+            if self.fuzzy:
+                scores = indexes.search.fuzzy_search(self.search_query)
+            else:
+                search_mask = indexes.search.search(self.search_query)
+        if self.isins and indexes.isins is not None:
+            isin_mask = indexes.isins.mask(self.isins)
+            search_mask = isin_mask if search_mask is None else search_mask & isin_mask
+
+        # Gather the rows of the selected areas, and keep the search results of those rows
+        rows = indexes.areas.rows(self.choice, self.areas) if indexes.areas is not None else None
+        if rows is not None and len(rows) > df.height // 2:
+            # Filtering with a mask is cheaper than gathering most of the table
+            area_mask = np.zeros(df.height, dtype=bool)
+            area_mask[rows] = True
+            search_mask = area_mask if search_mask is None else search_mask & area_mask
+            scores = np.where(area_mask, scores, 0) if scores is not None else None
+            rows = None
+        elif rows is not None:
+            df = df[rows]
+            search_mask = search_mask[rows] if search_mask is not None else None
+            scores = scores[rows] if scores is not None else None
+
+        if scores is not None:
+            df = df.with_columns(pl.Series(SCORE_COLUMN, scores))
+        plan = df.lazy()
+
+        predicates = self.predicates(df.columns, indexes, search_mask)
+        if scores is not None:
+            predicates.append(pl.col(SCORE_COLUMN) > 0)
+        if predicates:
+            plan = plan.filter(*predicates)
+
+        if scores is not None:
+            # The best matches first, and otherwise in the order of the dataset
+            plan = plan.sort(SCORE_COLUMN, descending=True, maintain_order=True).drop(SCORE_COLUMN)
+
+        return plan
+
+    def collect(self, df, indexes=None):
+        return self.plan(df, indexes).collect()
+
+    def explain(self, df, indexes=None):
+        """
+        The optimized query plan, for debugging.
+        """
+        return self.plan(df, indexes).explain()
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+
+from utils.log import log
+
+# The memory the cached results may use, in MB. The least recently used results are evicted.
+RESULT_CACHE_MB = int(os.environ.get("RESULT_CACHE_MB", "1024"))
+
+# Log the counters of the result cache every this many lookups
+LOG_EVERY_LOOKUPS = 100
+
+
+def result_size(value):
+    """
+    The approximate number of bytes a cached result holds.
+    """
+    # Frames, series and the search indexes of pushed-down selections
+    if hasattr(value, "estimated_size"):
+        return value.estimated_size()
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    The results of queries, shared by every session and page: the filtered rows, the formatted
+    frame and the export files. A result is keyed by the dataset version, the canonical query
+    and the part of the result, and the least recently used results are evicted when the
+    results hold more than max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dataset, query, part, build):
+        """
+        The part of the result of the query, built with build() if it is not cached.
+        """
+        key = (dataset.version, query.canonical(), part)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            lookups = self.hits + self.misses
+        if lookups % LOG_EVERY_LOOKUPS == 0:
+            self.log()
+        if entry is not None:
+            return entry[0]
+
+        # Built outside the lock, so other results are served meanwhile
+        value = build()
+        size = result_size(value)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+    def log(self):
+        log(
+            f"Result cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+            f"{len(self._entries)} results in {self.bytes / 1e6:.0f} of {self.max_bytes / 1e6:.0f} MB"
+        )
+
+
+# One cache for the whole server
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_MB * 1_000_000)
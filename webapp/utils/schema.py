@@ -0,0 +1,80 @@
+import polars as pl
+
+from utils.log import log
+
+# The canonical columns and dtypes of the investment data
+SCHEMA = {
+    "Index": pl.Int64,
+    "Område": pl.Utf8,
+    "ISIN kode": pl.Utf8,
+    "Værdipapirets navn": pl.Utf8,
+    "Udsteder": pl.Utf8,
+    "Markedsværdi (DKK)": pl.Float64,
+    "Type": pl.Utf8,
+    "Problematisk ifølge:": pl.Utf8,
+    "Eksklusion (Af hvem og hvorfor)": pl.Utf8,
+    "Sortlistet": pl.Int32,
+    "Problemkategori": pl.Utf8,
+    "Priority": pl.Float64,
+    "OBS": pl.Utf8,
+}
+
+# The order of the dataset: first by 'Sortlistet', then by 'Priority', followed by 'Område'
+# and 'ISIN kode'. Filtering preserves it, so views never have to be sorted again.
+SORT_COLUMNS = ["Sortlistet", "Priority", "Område", "ISIN kode"]
+SORT_DESCENDING = [True, True, False, False]
+
+# How many of the values that fail to parse are shown in the report
+REPORTED_VALUES = 5
+
+
+def source_expr(column, source_dtype, dtype):
+    expr = pl.col(column)
+    if source_dtype == pl.Utf8 and dtype.is_numeric():
+        # Surrounding whitespace should not make a number unparseable, and blanks are missing values
+        expr = expr.str.strip_chars()
+        expr = pl.when(expr != "").then(expr)
+    return expr
+
+
+def apply_schema(df, require_all=True):
+    """
+    Cast the data to the canonical dtypes. Values that cannot be parsed become null, and are
+    reported instead of being dropped silently. With require_all=False a column projection
+    is accepted, and only the columns present are cast.
+    """
+    missing = [column for column in SCHEMA if column not in df.columns]
+    if require_all and missing:
+        raise ValueError(f"The investment data is missing the columns: {', '.join(missing)}")
+
+    columns = [column for column in SCHEMA if column in df.columns]
+    sources = {column: source_expr(column, df.schema[column], SCHEMA[column]) for column in columns}
+    casts = {column: sources[column].cast(SCHEMA[column], strict=False) for column in columns}
+
+    # A value failed to parse if it was there before the cast, but not after
+    failures = df.select(
+        (sources[column].is_not_null() & casts[column].is_null()).alias(column)
+        for column in columns
+        if df.schema[column] != SCHEMA[column]
+    )
+    for column in failures.columns:
+        failed = df.filter(failures[column])[column]
+        if failed.len():
+            examples = ", ".join(repr(value) for value in failed.unique().head(REPORTED_VALUES))
+            log(
+                f"Schema: {failed.len()} values in '{column}' could not be read as {SCHEMA[column]}: {examples}"
+            )
+
+    return df.with_columns(casts[column].alias(column) for column in columns).select(columns)
+
+
+def presort(df):
+    # maintain_order keeps ties in the order of the database, so the order is reproducible
+    return df.sort(SORT_COLUMNS, descending=SORT_DESCENDING, nulls_last=True, maintain_order=True)
+
+
+def encode_areas(df, areas):
+    """
+    Store 'Område' as an Enum of the areas, sorted so the Enum sorts like the names.
+    """
+    return df.with_columns(pl.col("Område").cast(pl.Enum(sorted(areas))))
@@ -0,0 +1,277 @@
+import numpy as np
+import polars as pl
+
+from utils.dataset import derived_cache
+from utils.query import SEARCH_COLUMNS, normalize_expr, normalize_text
+from utils.synonyms import SYNONYMS
+
+# How similar (shared trigrams out of all trigrams) a word must be to count as a typo
+FUZZY_THRESHOLD = 0.3
+
+
+def trigrams(word):
+    # Padded like in PostgreSQL's pg_trgm, so the start of a word weighs more than the end
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def synonym_pairs():
+    """
+    Every (word, synonym) pair in the synonym table.
+    """
+    return pl.DataFrame(
+        [
+            (word, synonym)
+            for group in SYNONYMS
+            for word in group
+            for synonym in group
+            if word != synonym
+        ],
+        schema=["Token", "Synonym"],
+        orient="row",
+    )
+
+
+class SearchIndex:
+    """
+    Inverted index from the normalized tokens of the searchable columns to the rows that
+    contain them, by their position in the dataset. A search matches the same rows as a
+    substring scan of the normalized columns, but only looks at the rows the index points to.
+
+    Synonyms are indexed separately for every row containing a word they are a synonym of, and
+    only a query word that is exactly a synonym finds them, so parts of words only ever match
+    the text of the rows. The trigrams of every token are indexed as well, for searches that
+    allow typos.
+    """
+
+    def __init__(self, df):
+        self.columns = [column for column in SEARCH_COLUMNS if column in df.columns]
+        self.height = df.height
+
+        texts = df.select(
+            normalize_expr(pl.col(column).cast(pl.Utf8).fill_null("")) for column in self.columns
+        )
+
+        # The normalized columns of every row joined by line breaks, to verify multi-word
+        # matches. A normalized query has no line breaks, so it never spans two columns.
+        self.text = texts.select(pl.concat_str(pl.all(), separator="\n")).to_series()
+
+        occurrences = (
+            texts.with_row_index("Row")
+            .unpivot(index="Row", on=self.columns, value_name="Token")
+            .select("Row", pl.col("Token").str.split(" "))
+            .explode("Token")
+            .filter(pl.col("Token") != "")
+        )
+
+        # One row per token, with the positions of every row that contains it
+        postings = occurrences.group_by("Token").agg(pl.col("Row").unique())
+        self.tokens = postings["Token"]
+
+        # The posting lists stored back to back, so matching tokens can be expanded at once
+        self.lengths = postings["Row"].list.len().to_numpy().astype(np.int64)
+        self.rows = postings["Row"].explode().to_numpy()
+        self.offsets = np.cumsum(self.lengths) - self.lengths
+
+        # Synonym -> positions of the rows containing a word it is a synonym of
+        synonyms = (
+            occurrences.join(synonym_pairs(), on="Token")
+            .group_by("Synonym")
+            .agg(pl.col("Row").unique())
+        )
+        self.synonyms = dict(
+            zip(synonyms["Synonym"], (rows.to_numpy() for rows in synonyms["Row"]))
+        )
+
+        # Trigram -> positions of the tokens that contain it
+        token_trigrams = [trigrams(token) for token in self.tokens]
+        self.trigram_counts = np.array([len(grams) for grams in token_trigrams])
+        trigram_tokens = {}
+        for token_id, grams in enumerate(token_trigrams):
+            for gram in grams:
+                trigram_tokens.setdefault(gram, []).append(token_id)
+        self.trigram_tokens = {gram: np.array(ids) for gram, ids in trigram_tokens.items()}
+
+    def estimated_size(self):
+        """
+        The approximate number of bytes the index holds, for the result cache.
+        """
+        arrays = [self.lengths, self.rows, self.offsets, self.trigram_counts]
+        return (
+            self.text.estimated_size()
+            + self.tokens.estimated_size()
+            + sum(array.nbytes for array in arrays)
+            + sum(token_ids.nbytes for token_ids in self.trigram_tokens.values())
+            + sum(rows.nbytes for rows in self.synonyms.values())
+        )
+
+    def rows_with_tokens(self, token_mask):
+        """
+        A boolean mask of the rows that contain any of the tokens in the token mask.
+        """
+        # The positions of the postings of the tokens, so only their posting lists are read
+        token_ids = np.flatnonzero(np.asarray(token_mask))
+        lengths = self.lengths[token_ids]
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(
+            self.offsets[token_ids] - (ends - lengths), lengths
+        )
+
+        mask = np.zeros(self.height, dtype=bool)
+        mask[self.rows[positions]] = True
+        return mask
+
+    def rows_with_synonym(self, word):
+        """
+        A boolean mask of the rows containing a word the word is a synonym of.
+        """
+        mask = np.zeros(self.height, dtype=bool)
+        if word in self.synonyms:
+            mask[self.synonyms[word]] = True
+        return mask
+
+    def tokens_containing(self, word, token_ids=None):
+        """
+        A boolean mask of the tokens that contain the word, only looking at the tokens in
+        token_ids if given.
+        """
+        if token_ids is None:
+            return self.tokens.str.contains(word, literal=True).to_numpy()
+        token_mask = np.zeros(len(self.tokens), dtype=bool)
+        token_mask[token_ids] = self.tokens[token_ids].str.contains(word, literal=True).to_numpy()
+        return token_mask
+
+    def verify(self, candidates, normalized_search_query):
+        """
+        A boolean mask of the candidate rows where a searchable column contains the normalized
+        search query.
+        """
+        matches = self.text[candidates].str.contains(normalized_search_query, literal=True)
+        mask = np.zeros(self.height, dtype=bool)
+        mask[candidates[matches.to_numpy()]] = True
+        return mask
+
+    def search(self, search_query):
+        """
+        A boolean mask of the rows where any searchable column contains the normalized search
+        query, or None if the query does not filter anything.
+        """
+        normalized_search_query = normalize_text(search_query)
+        if not normalized_search_query:
+            return None
+
+        words = normalized_search_query.split(" ")
+        if len(words) == 1:
+            # A single word can be part of a longer word, but never spans two words
+            mask = self.rows_with_tokens(self.tokens_containing(words[0]))
+            return mask | self.rows_with_synonym(words[0])
+
+        # A phrase starts at the end of a word, continues through whole words and ends at the
+        # start of a word. Every row containing it has all of these words.
+        token_masks = (
+            [self.tokens.str.ends_with(words[0])]
+            + [self.tokens == word for word in words[1:-1]]
+            + [self.tokens.str.starts_with(words[-1])]
+        )
+        mask = self.rows_with_tokens(token_masks[0])
+        for token_mask in token_masks[1:]:
+            mask &= self.rows_with_tokens(token_mask)
+
+        # Keep the candidates where the words are next to each other in the same column
+        return self.verify(np.flatnonzero(mask), normalized_search_query)
+
+    def similarity(self, word):
+        """
+        How similar every token is to the word: 1 for tokens containing it (as in the exact
+        search), otherwise the trigram similarity if it is above FUZZY_THRESHOLD, and 0.
+        """
+        word_trigrams = trigrams(word)
+        token_ids = [
+            self.trigram_tokens[gram] for gram in word_trigrams if gram in self.trigram_tokens
+        ]
+        shared = np.bincount(
+            np.concatenate(token_ids) if token_ids else np.array([], dtype=int),
+            minlength=len(self.tokens),
+        )
+        similarity = shared / (len(word_trigrams) + self.trigram_counts - shared)
+        similarity[similarity < FUZZY_THRESHOLD] = 0
+        similarity[self.tokens_containing(word)] = 1
+        return similarity
+
+    def fuzzy_search(self, search_query):
+        """
+        The similarity of every row to the search query, where 0 is no match, or None if the
+        query does not filter anything. Every word must match a token of the row, and the
+        score is the average similarity of the best matching tokens.
+        """
+        normalized_search_query = normalize_text(search_query)
+        if not normalized_search_query:
+            return None
+
+        words = normalized_search_query.split(" ")
+        scores = np.zeros(self.height)
+        for i, word in enumerate(words):
+            posting_scores = np.repeat(self.similarity(word), self.lengths)
+            matched = posting_scores > 0
+
+            word_scores = np.zeros(self.height)
+            np.maximum.at(word_scores, self.rows[matched], posting_scores[matched])
+            word_scores[self.rows_with_synonym(word)] = 1
+            scores = (
+                word_scores
+                if i == 0
+                else np.where(scores * word_scores > 0, scores + word_scores, 0)
+            )
+
+        return scores / len(words)
+
+
+class IncrementalSearch:
+    """
+    The searches of one session on a SearchIndex. Every row matching a query also matches the
+    queries it contains, so a query that extends the previous one (a longer word or another
+    word) only looks at the rows, or for a single word the tokens, that the previous one
+    matched. Any other query searches the whole index.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.last_query = None
+        self.last_mask = None
+        self.last_tokens = None
+
+    def search(self, search_query):
+        normalized_search_query = normalize_text(search_query)
+        if not normalized_search_query:
+            return None
+
+        words = normalized_search_query.split(" ")
+        refines = self.last_query is not None and self.last_query in normalized_search_query
+        if refines and len(words) == 1 and self.last_tokens is not None:
+            # The tokens containing the longer word all contain the previous word
+            token_ids = np.flatnonzero(self.last_tokens)
+            token_mask = self.index.tokens_containing(words[0], token_ids)
+            mask = self.index.rows_with_tokens(token_mask) | self.index.rows_with_synonym(words[0])
+        elif refines:
+            token_mask = None
+            mask = self.index.verify(np.flatnonzero(self.last_mask), normalized_search_query)
+        elif len(words) == 1:
+            token_mask = self.index.tokens_containing(words[0])
+            mask = self.index.rows_with_tokens(token_mask) | self.index.rows_with_synonym(words[0])
+        else:
+            token_mask = None
+            mask = self.index.search(normalized_search_query)
+
+        self.last_query = normalized_search_query
+        self.last_mask = mask
+        self.last_tokens = token_mask
+        return mask
+
+    def fuzzy_search(self, search_query):
+        # Typos can match rows the previous query did not, so these always search everything
+        return self.index.fuzzy_search(search_query)
+
+
+@derived_cache
+def get_search_index(dataset):
+    return SearchIndex(dataset.df)
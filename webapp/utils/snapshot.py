@@ -0,0 +1,86 @@
+import json
+import os
+
+import polars as pl
+
+from utils.bitmask import bit_values, encode_bitmasks
+from utils.database import DATABASE_PATH, read_investments
+from utils.log import log
+from utils.schema import apply_schema, encode_areas, presort
+
+# Bump the version whenever the columns or dtypes written to the snapshot change,
+# so snapshots built by an older version of the app are never read.
+SNAPSHOT_VERSION = 4
+SNAPSHOT_PATH = f"data/investerings_database.snapshot-v{SNAPSHOT_VERSION}.arrow"
+
+# The modification time and size of the database the snapshot was built from
+SNAPSHOT_SOURCE_PATH = f"{SNAPSHOT_PATH}.source.json"
+
+
+def read_database():
+    # Validate and apply the canonical dtypes, sort and decode the areas and multi-valued
+    # columns once, so nothing is cast, sorted or split per request
+    df = presort(apply_schema(read_investments()))
+    df = encode_areas(df, df["Område"].drop_nulls().unique())
+    return encode_bitmasks(df, bit_values(df))
+
+
+def database_source():
+    """
+    Identify the database by its exact modification time and size.
+    """
+    stat = os.stat(DATABASE_PATH)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def snapshot_is_fresh():
+    """
+    The snapshot is usable if it exists and was built from the database as it is now. The
+    modification time must match exactly, so a database replaced by an older file (cp -p,
+    rsync -a, docker COPY) is not served from the snapshot of the previous one.
+    """
+    if not os.path.exists(SNAPSHOT_PATH):
+        return False
+    if not os.path.exists(DATABASE_PATH):
+        return True
+    try:
+        with open(SNAPSHOT_SOURCE_PATH) as f:
+            return json.load(f) == database_source()
+    except (OSError, ValueError):
+        # Snapshots without a readable source are rebuilt
+        return False
+
+
+def read_snapshot():
+    # Uncompressed Arrow IPC is memory-mapped by Polars instead of being parsed into memory
+    return pl.read_ipc(SNAPSHOT_PATH)
+
+
+def write_snapshot(df, source):
+    # Write to temporary files first, so readers never see a half-written snapshot
+    tmp_path = f"{SNAPSHOT_PATH}.tmp"
+    df.rechunk().write_ipc(tmp_path, compression="uncompressed")
+    tmp_source_path = f"{SNAPSHOT_SOURCE_PATH}.tmp"
+    with open(tmp_source_path, "w") as f:
+        json.dump(source, f)
+    # The source last, so a new snapshot with the previous source is stale rather than an old
+    # snapshot with the new source being fresh
+    os.replace(tmp_path, SNAPSHOT_PATH)
+    os.replace(tmp_source_path, SNAPSHOT_SOURCE_PATH)
+
+
+def build_snapshot():
+    """
+    Compile the SQLite database into the Arrow snapshot and return the compiled data.
+    """
+    # Before reading, so a database replaced during the read is never taken for the source
+    source = database_source()
+    df = read_database()
+
+    try:
+        write_snapshot(df, source)
+    except OSError as e:
+        # A read-only data volume should not stop the app from serving the data
+        log(f"Could not write snapshot {SNAPSHOT_PATH}: {e}")
+
+    return df
@@ -0,0 +1,41 @@
+# Words that should find each other in the free-text search, typically the Danish and English
+# names of a country or the aliases of a company. The words are normalized like the search
+# (see normalize_text), and every word in a group is added to the search index wherever one
+# of the others appears, so a search on 'Kina' also finds 'China'.
+SYNONYMS = [
+    # Countries
+    ("kina", "china", "chinese"),
+    ("rusland", "russia", "russian"),
+    ("hviderusland", "belarus"),
+    ("israel", "israeli"),
+    ("tyskland", "germany", "german"),
+    ("frankrig", "france", "french"),
+    ("danmark", "denmark", "danish"),
+    ("sverige", "sweden", "swedish"),
+    ("norge", "norway", "norwegian"),
+    ("finland", "finnish"),
+    ("storbritannien", "britain", "british"),
+    ("spanien", "spain", "spanish"),
+    ("italien", "italy", "italian"),
+    ("polen", "poland", "polish"),
+    ("ungarn", "hungary", "hungarian"),
+    ("tyrkiet", "turkey", "turkiye"),
+    ("egypten", "egypt", "egyptian"),
+    ("indien", "india", "indian"),
+    ("indonesien", "indonesia", "indonesian"),
+    ("brasilien", "brazil", "brazilian"),
+    ("mexico", "mexiko", "mexican"),
+    ("colombia", "colombian"),
+    ("filippinerne", "philippines", "philippine"),
+    ("arabien", "arabia", "arabian"),
+    ("myanmar", "burma"),
+    # Companies
+    ("alphabet", "google"),
+    ("meta", "facebook"),
+    ("exxon", "exxonmobil"),
+    # Problem areas
+    ("tobak", "tobacco"),
+    ("kul", "coal"),
+    ("olie", "oil"),
+    ("våben", "weapons", "arms"),
+]
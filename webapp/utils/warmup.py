@@ -0,0 +1,58 @@
+import time
+
+from utils.data_processing import (
+    get_ai_texts,
+    get_unique_kommuner,
+    get_unique_categories,
+    export_frame,
+    get_export,
+    get_filtered_df,
+    to_excel_function,
+)
+from utils.areas import get_area_index
+from utils.cube import get_cube
+from utils.dataset import LAZY_QUERIES, get_dataset
+from utils.isin import get_isin_index
+from utils.log import log
+from utils.plots import get_pie_chart
+from utils.query import InvestmentQuery
+from utils.search import get_search_index
+
+
+def timed(step, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    log(f"Warm-up: {step} took {time.perf_counter() - started:.2f}s")
+    return result
+
+
+def warm_up(dataset=None):
+    """
+    Precompute everything the default "Hele landet" view needs, so no visitor pays for it.
+    """
+    started = time.perf_counter()
+
+    if dataset is None:
+        dataset = timed("get_dataset", get_dataset)
+
+    timed("get_ai_texts", get_ai_texts, dataset)
+    timed("get_unique_kommuner", get_unique_kommuner, dataset)
+    timed("get_unique_categories", get_unique_categories, dataset)
+
+    if LAZY_QUERIES:
+        # The "Hele landet" view would materialize the national table, which this mode avoids
+        log(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+        return
+
+    # The results of "Hele landet" go into the result cache, like those of any other query
+    hele_landet = InvestmentQuery()
+    timed("get_search_index", get_search_index, dataset)
+    timed("get_area_index", get_area_index, dataset)
+    timed("get_isin_index", get_isin_index, dataset)
+    rows = timed("get_filtered_df", get_filtered_df, dataset, hele_landet)
+    cube = timed("get_cube", get_cube, dataset)
+    timed("get_pie_chart", get_pie_chart, dataset, hele_landet, cube)
+    excel_df = export_frame(rows)
+    timed("get_export", get_export, dataset, hele_landet, "xlsx", to_excel_function, excel_df)
+
+    log(f"Warm-up finished in {time.perf_counter() - started:.2f}s")